@@ -0,0 +1,337 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# -----------------------------
+# Benchmark of the analyzer on synthetic chat traffic. Every stage runs in its own process so its peak memory is
+# measured on its own, and the results are saved as JSON so runs before and after a change can be compared.
+# -----------------------------
+benchmark_sizes = [1000, 100000, 1000000]
+benchmark_stages = ["extract_parameters", "process_group", "insert_data_to_db", "main"]
+benchmark_seed = 2025
+results_dir = "benchmark_results"
+import_modules = ["chat_analyzer", "chat_query"]  # Modules whose import time is tracked
+import_runs = 5  # Imports timed per module, the median is reported
+
+chatter = ["Good morning", "ok", "Noted", "<Media omitted>", "Please confirm the meter reading", "Thanks",
+           "Skid change in progress", "Inlet pressure: 12", "Total flow 55 thanks", "Call me when you get this",
+           'Use the 2" hose on skid 4', '"Noted" boss', 'Pressure gauge says 3" mark']
+senders = ["Emeka", "Tunde", "Ngozi", "Aisha", "Chidi", "Bola", "Ifeanyi"]
+
+# -----------------------------
+# Synthetic traffic
+# -----------------------------
+def typo(label, rng):
+    """Drop or swap a letter of a label, like a hurried operator would"""
+    i = rng.randrange(1, len(label) - 1)
+    if rng.random() < 0.5:
+        return label[:i] + label[i + 1:]
+    return label[:i] + label[i + 1] + label[i] + label[i + 2:]
+
+def reading(value, rng, digits=1):
+    """Format a reading, sometimes with a stray trailing dot that float() rejects"""
+    text = f"{value:.{digits}f}"
+    return text + "." if rng.random() < 0.01 else text
+
+def tempo_message(state, rng):
+    return (f"Skid in use: {state['skid']} Decanting: {state['next_skid']} Standby skid: 3 Empty skid: NIL "
+            f"Inlet pressure: {reading(state['pressure'], rng)}Bar Flow rate: {rng.randint(80, 160)} (SCM/HR) "
+            f"Interstage pressure: 40Bar Total flow: {reading(state['flow'], rng, 2)} Discharge: 200bar "
+            f"Outlet temp: {rng.randint(25, 40)}°C Inlet temp: {rng.randint(20, 30)}°C")
+
+def splendor_message(state, rng):
+    return (f"Skid in use:{state['skid']}\nDecanting {state['next_skid']}\nInlet pressure {reading(state['pressure'], rng)} B"
+            f"\nFlow rate: {rng.randint(60, 120)}\nInterstage 30 B\nTotalizer flow: {reading(state['flow'], rng, 2)}"
+            f"\nDischarge: 150 B")
+
+def nigachem_message(state, rng):
+    return (f"Empty:2 Standby:1 Decanting:{state['skid']} Pressures:{reading(state['pressure'], rng)} "
+            f"FLOW rate :{rng.randint(30, 70)} TOTAL FLOW tm:{reading(state['flow'] * 0.98, rng, 2)} "
+            f"TOTAL FLOW ptz:{reading(state['flow'], rng, 2)} Temperature:{rng.randint(25, 35)} Discharge:12")
+
+def wasil_message(state, rng):
+    return (f"Empty:1 Standby:2 Decanting:{state['next_skid']} In transit:1 Inlet pressure:{reading(state['pressure'], rng)} "
+            f"Inlet temp:20 Flow rate:{rng.randint(20, 40)} Total flow:{reading(state['flow'], rng, 2)} "
+            f"Discharge Temp:40 Discharge Pressure:50 Skid No: {100 + state['skid']}")
+
+group_formats = {
+    'Axxela CNG Supply to Tempo': tempo_message,
+    'CNG Supply to Splendor Electric': splendor_message,
+    'Nigachem CNG Supply': nigachem_message,
+    'Axxela CNG Wasil': wasil_message
+}
+
+def generate_messages(rows, seed=benchmark_seed):
+    """Return `rows` chat log records (group, sender, message, phone, date, time, message id) in the formats of the
+    supply groups.
+
+    Pressure falls while a skid is decanted and jumps when the skid is swapped, the totalizer only grows. About a
+    quarter of the messages are chatter, some readings have typos in their labels or unparsable numbers, some
+    messages hold an unpaired '"', and a few messages come from a group without a mapping.
+    """
+    rng = random.Random(seed)
+    groups = list(group_formats)
+    states = {group: {"pressure": rng.uniform(180, 250), "flow": rng.uniform(1000, 50000),
+                      "skid": rng.randint(1, 9), "next_skid": rng.randint(1, 9)} for group in groups}
+    stamp = datetime(2025, 1, 1, 6, 0, 0)
+    records = []
+    for i in range(rows):
+        stamp += timedelta(seconds=rng.randint(1, 90))
+        sender = rng.choice(senders)
+        phone = f"23480{senders.index(sender):02d}{i % 100000:06d}"
+        date = f"{stamp.month}/{stamp.day}/{stamp.year}"
+        clock = f"{stamp.hour % 12 or 12}:{stamp.minute:02d}:{stamp.second:02d} {'AM' if stamp.hour < 12 else 'PM'}"
+        message_id = f"false_120363315079438311@g.us_3EB0{rng.getrandbits(64):016X}"
+
+        roll = rng.random()
+        if roll < 0.02:
+            records.append(("CNG Dispatch", sender, f"Truck {rng.randint(1, 40)} left the yard", phone, date, clock,
+                            message_id))
+            continue
+        group = rng.choice(groups)
+        if roll < 0.27:
+            records.append((group, sender, rng.choice(chatter), phone, date, clock, message_id))
+            continue
+
+        state = states[group]
+        if state["pressure"] < 30 or rng.random() < 0.02:
+            # Skid swap: a full skid comes on line
+            state["pressure"] = rng.uniform(180, 250)
+            state["skid"], state["next_skid"] = state["next_skid"], rng.randint(1, 9)
+        else:
+            state["pressure"] = max(0.0, state["pressure"] - rng.uniform(0, 6))
+        state["flow"] += rng.uniform(5, 60)
+        message = group_formats[group](state, rng)
+        if rng.random() < 0.03:
+            label = rng.choice(["Inlet pressure", "Total flow", "Pressures", "TOTAL FLOW ptz"])
+            message = message.replace(label, typo(label, rng))
+        if rng.random() < 0.01:
+            # A stray inch mark, which index.js logs as it is
+            message += ' on the 2" line'
+        records.append((group, sender, message, phone, date, clock, message_id))
+    return records
+
+def write_chat_log(path, records):
+    """Write records the way index.js logs them: line breaks of the group, sender and message replaced by spaces,
+    their commas dropped, and the fields joined with commas without any quoting"""
+    def sanitize(text):
+        return text.replace("\n", " ").replace("\r", " ").replace(",", "")
+
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        f.write("Group Name,Sender Name,Message,Phone Number,Date,Time,Message ID\n")
+        for group, sender, message, phone, date, clock, message_id in records:
+            f.write(f"{sanitize(group)},{sanitize(sender)},{sanitize(message)},{phone},{date},{clock},{message_id}\n")
+
+# -----------------------------
+# Stages. Each returns the seconds spent in the measured call only.
+# -----------------------------
+def bench_extract_parameters(analyzer, records):
+    mappings = [analyzer.group_mappings.get(record[0]) for record in records]
+    start = time.perf_counter()
+    for record, config in zip(records, mappings):
+        if config is not None:
+            analyzer.extract_parameters(record[2], config['params'])
+    return time.perf_counter() - start
+
+def bench_process_group(analyzer, records):
+    import pandas as pd
+    df = pd.DataFrame(records, columns=analyzer.csv_columns)
+    groups = [(name, group_df) for name, group_df in df.groupby('Group Name')]
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for name, group_df in groups:
+            analyzer.process_group(group_df, name, {})
+    return time.perf_counter() - start
+
+def bench_insert_data_to_db(analyzer, records, work_dir):
+    import pandas as pd
+    df = pd.DataFrame(records, columns=analyzer.csv_columns)
+    conn = analyzer.connect_database(os.path.join(work_dir, "insert.db"))
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        analyzer.initialize_database(conn)
+        processed = []
+        for name, group_df in df.groupby('Group Name'):
+            analyzer.create_group_table(conn, name)
+            processed.append((name, analyzer.process_group(group_df, name, {})))
+        start = time.perf_counter()
+        for name, processed_df in processed:
+            if processed_df is not None:
+                analyzer.insert_data_to_db(conn, name, processed_df)
+        elapsed = time.perf_counter() - start
+    conn.close()
+    return elapsed
+
+def bench_main(analyzer, work_dir):
+    """Time main() on the chat log in work_dir, written beforehand so the generated records aren't in memory"""
+    for name, file_name in analyzer.data_files.items():
+        setattr(analyzer.settings, name, os.path.join(work_dir, file_name))
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        analyzer.main()
+    return time.perf_counter() - start
+
+def peak_rss_mib():
+    """Peak resident memory of this process in MiB, None where it can't be read"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS bytes
+        return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / 1024 / 1024, 1)
+    except ImportError:
+        return None
+
+def run_stage(stage, rows, seed):
+    """Run one stage on `rows` generated messages in this process and return its result"""
+    import chat_analyzer as analyzer
+    with tempfile.TemporaryDirectory() as work_dir:
+        if stage == "main":
+            # The chat log is written by another process, so the generated records don't count towards main's memory
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--write-log", os.path.join(work_dir, "chat_logs.csv"),
+                            str(rows), "--seed", str(seed)], check=True)
+            seconds = bench_main(analyzer, work_dir)
+            return stage_result(stage, rows, seconds)
+
+        records = generate_messages(rows, seed)
+        if stage == "extract_parameters":
+            seconds = bench_extract_parameters(analyzer, records)
+        elif stage == "process_group":
+            seconds = bench_process_group(analyzer, records)
+        else:
+            seconds = bench_insert_data_to_db(analyzer, records, work_dir)
+    return stage_result(stage, rows, seconds)
+
+def stage_result(stage, rows, seconds):
+    return {"stage": stage, "rows": rows, "seconds": round(seconds, 4),
+            "rows_per_sec": round(rows / seconds) if seconds > 0 else None, "peak_rss_mib": peak_rss_mib()}
+
+# -----------------------------
+# Import time. Measured with python -X importtime in fresh interpreters, so cron runs and the query tool don't
+# start with pandas' half second again unnoticed.
+# -----------------------------
+def import_time_ms(module):
+    """Milliseconds one fresh interpreter spends importing `module`, including everything it imports"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True,
+                          text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            return round(int(fields[1]) / 1000, 2)
+    raise RuntimeError(f"No import time reported for {module}")
+
+def measure_import_times(modules=import_modules, runs=import_runs):
+    """Median import time of every module in ms, with the heavy modules each one imported on the way"""
+    results = []
+    for module in modules:
+        times = sorted(import_time_ms(module) for _ in range(runs))
+        proc = subprocess.run([sys.executable, "-c", f"import sys, {module}; "
+                               "print(','.join(m for m in ('pandas', 'numpy', 'pyarrow') if m in sys.modules))"],
+                              capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+        result = {"module": module, "import_ms": times[len(times) // 2], "min_ms": times[0],
+                  "heavy_imports": [name for name in proc.stdout.strip().split(",") if name]}
+        results.append(result)
+        print(f"{'import ' + module:>20} {result['import_ms']:>9.2f}ms (min {result['min_ms']:.2f}ms)"
+              f"{' loads ' + ', '.join(result['heavy_imports']) if result['heavy_imports'] else ''}")
+    return results
+
+# -----------------------------
+# Runner
+# -----------------------------
+def run_benchmark(sizes, stages, seed):
+    """Run every stage at every size, each in a fresh interpreter, and return the results"""
+    results = []
+    for rows in sizes:
+        for stage in stages:
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", stage, str(rows),
+                                   "--seed", str(seed)], capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"{stage} at {rows} rows failed:\n{proc.stderr}")
+                continue
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            results.append(result)
+            print(f"{stage:>20} {rows:>9} rows {result['seconds']:>9.3f}s {result['rows_per_sec'] or 0:>10} rows/s "
+                  f"peak {result['peak_rss_mib']} MiB")
+    return results
+
+def compare_results(results, imports, baseline_file):
+    """Print the speedup of every stage and size, and of every import, against an earlier results file"""
+    with open(baseline_file, 'r') as f:
+        report = json.load(f)
+    baseline = {(r["stage"], r["rows"]): r for r in report["results"]}
+    baseline_imports = {r["module"]: r for r in report.get("imports", [])}
+    for result in imports:
+        before = baseline_imports.get(result["module"])
+        if before and result["import_ms"]:
+            print(f"{'import ' + result['module']:>20} {before['import_ms'] / result['import_ms']:.2f}x "
+                  f"({before['import_ms']:.2f}ms -> {result['import_ms']:.2f}ms)")
+    for result in results:
+        before = baseline.get((result["stage"], result["rows"]))
+        if before and result["seconds"]:
+            print(f"{result['stage']:>20} {result['rows']:>9} rows {before['seconds'] / result['seconds']:.2f}x "
+                  f"({before['seconds']:.3f}s -> {result['seconds']:.3f}s)")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark chat_analyzer.py on synthetic chat traffic")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in benchmark_sizes),
+                        help="comma separated message counts")
+    parser.add_argument("--stages", default=",".join(benchmark_stages), help="comma separated stages to run")
+    parser.add_argument("--seed", type=int, default=benchmark_seed, help="seed of the message generator")
+    parser.add_argument("--out", help=f"results file (default: {results_dir}/<date and time>.json)")
+    parser.add_argument("--compare", metavar="FILE", help="earlier results file to compare against")
+    parser.add_argument("--import-runs", type=int, default=import_runs,
+                        help="fresh interpreters the import time is measured in (0 to skip it)")
+    parser.add_argument("--child", nargs=2, metavar=("STAGE", "ROWS"), help=argparse.SUPPRESS)
+    parser.add_argument("--write-log", nargs=2, metavar=("PATH", "ROWS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.write_log:
+        write_chat_log(args.write_log[0], generate_messages(int(args.write_log[1]), args.seed))
+        sys.exit(0)
+
+    if args.child:
+        print(json.dumps(run_stage(args.child[0], int(args.child[1]), args.seed)))
+        sys.exit(0)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = [stage for stage in stages if stage not in benchmark_stages]
+    if unknown:
+        parser.error(f"unknown stages {unknown}, choose from {benchmark_stages}")
+
+    started = datetime.now()
+    imports = measure_import_times(runs=args.import_runs) if args.import_runs > 0 else []
+    results = run_benchmark(sizes, stages, args.seed)
+    import pandas as pd
+    report = {
+        "started": started.isoformat(timespec="seconds"),
+        "seed": args.seed,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "imports": imports,
+        "results": results
+    }
+    out_file = args.out or os.path.join(results_dir, started.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(out_file) or ".", exist_ok=True)
+    with open(out_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {out_file}")
+    if args.compare:
+        compare_results(results, imports, args.compare)
@@ -1,18 +1,66 @@
-import pandas as pd
 import os
 import re
 import json
+import hashlib
+import importlib
+import itertools
 import sqlite3  # Using SQLite for demo purposes - deployment could be PostgreSQL, MySQL, etc as advised by IT.
 from datetime import datetime
 import traceback
+import select
+import signal
+import struct
+import time
+import bisect
+import threading
 # import sys
 
 # -----------------------------
-# File paths
+# Heavy modules. pandas (with pyarrow) and numpy take most of a second to import, so they are only imported when a
+# DataFrame path first runs; importing this module, e.g. from chat_query.py or a short-lived cron job that finds no
+# new lines, stays cheap. asyncio, http.server, concurrent.futures and argparse are imported where they are used.
 # -----------------------------
-csv_file = r"C:\Users\okezi\OneDrive\Documents\Git\whatsapp-bot-main\chat_logs.csv"
-database_file = r"C:\Users\okezi\OneDrive\Documents\Git\whatsapp-bot-main\whatsapp_logs.db"
-context_file = r"C:\Users\okezi\OneDrive\Documents\Git\whatsapp-bot-main\skid_context.json"
+class LazyModule:
+    """Stand-in for a module that is imported the first time one of its attributes is used"""
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        value = getattr(importlib.import_module(self._name), attr)
+        # Later lookups of the same attribute don't come through here again
+        setattr(self, attr, value)
+        return value
+
+pd = LazyModule("pandas")
+np = LazyModule("numpy")
+
+# -----------------------------
+# File paths. Worked out the first time each one is used: WHATSAPP_BOT_<NAME> (e.g. WHATSAPP_BOT_DATABASE_FILE)
+# sets a single file, WHATSAPP_BOT_DIR the folder holding all of them. Assigning a setting, as the command line
+# options do, overrides both.
+# -----------------------------
+data_dir = os.path.dirname(os.path.abspath(__file__))  # Next to the scripts, where index.js writes chat_logs.csv
+data_files = {
+    "csv_file": "chat_logs.csv",
+    "database_file": "whatsapp_logs.db",
+    # State files of earlier versions, only read once to import them into the database
+    "context_file": "skid_context.json",
+    "checkpoint_file": "csv_checkpoint.json",
+    "metrics_file": "chat_analyzer.prom",
+    "excel_file": "whatsapp_logs_export.xlsx",
+}
+
+class Settings:
+    """File locations of the analyzer, each worked out on first use and then kept"""
+    def __getattr__(self, name):
+        if name not in data_files:
+            raise AttributeError(f"No setting named '{name}'")
+        value = (os.environ.get("WHATSAPP_BOT_" + name.upper())
+                 or os.path.join(os.environ.get("WHATSAPP_BOT_DIR") or data_dir, data_files[name]))
+        setattr(self, name, value)
+        return value
+
+settings = Settings()
 
 # -----------------------------
 # Regex parameter mappings for different groups. Note each group needs a different regex as the message format is group specific
@@ -79,6 +127,9 @@ heirs_param_mapping = {
     "CHGC AGI Temperature": r"CHGC AGI\s+?Temperature: ([\d.]+)"
 }
 
+# Parameters that hold skid numbers or labels and are kept as text. Everything else is converted to a float
+text_params = ['Skid in use', 'Standby skid', 'Empty skid', 'Decanting', 'Standby', 'Empty', 'Skid No', 'In transit']
+
 # -----------------------------
 # Define which parameter to use for each group. CNG disatch group not included for now
 # -----------------------------
@@ -86,49 +137,227 @@ group_mappings = {
     'Axxela CNG Supply to Tempo': {
         'params': tempo_param_mapping,
         'pressure_field': 'Inlet pressure',
-        'flow_field': 'Total flow'
+        'flow_field': 'Total flow',
+        'skid_field': 'Skid in use'  # Identifies the skid in skid_sessions
     },
     'CNG Supply to Splendor Electric': {
         'params': splendor_param_mapping,
         'pressure_field': 'Inlet pressure',
-        'flow_field': 'Total flow'
+        'flow_field': 'Total flow',
+        'skid_field': 'Skid in use'
     },
     'Nigachem CNG Supply': {
         'params': nigachem_param_mapping,
         'pressure_field': 'Pressures',
-        'flow_field': 'TOTAL FLOW ptz'  
+        'flow_field': 'TOTAL FLOW ptz',
+        'skid_field': 'Decanting'
     },
     'Axxela CNG Wasil': {
         'params': wasil_param_mapping,
         'pressure_field': 'Inlet pressure',
-        'flow_field': 'Total flow'
+        'flow_field': 'Total flow',
+        'skid_field': 'Skid No'
     }
 }
 
+# How the Date and Time columns are written (toLocaleDateString()/toLocaleTimeString() on the bot host, en-US by
+# default). They are parsed into event_ts, "YYYY-MM-DD HH:MM:SS" in the bot host's local time, which sorts and range
+# scans as text. Change this if the host uses another locale.
+timestamp_format = "%m/%d/%Y %I:%M:%S %p"
+
 # -----------------------------
-# Load or initialize skid context
+# Skid context and CSV checkpoint. Both are kept in the database and written in the same transaction as the rows they
+# describe, so a crash can never leave the context ahead of or behind the data. The JSON files used by earlier
+# versions are imported once.
 # -----------------------------
-def load_skid_context():
-    if os.path.exists(context_file):
+context_keys = ["last_pressure", "last_total_flow", "skid_baseline_flow", "last_skid_change"]
+
+def create_state_tables(conn):
+    """Create the tables holding the skid context and other analyzer state"""
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS skid_context (
+        group_name TEXT PRIMARY KEY,
+        last_pressure REAL,
+        last_total_flow REAL,
+        skid_baseline_flow REAL,
+        last_skid_change TEXT
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS analyzer_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    ''')
+
+def load_skid_context(conn):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT group_name, {', '.join(context_keys)} FROM skid_context")
+    return {row[0]: dict(zip(context_keys, row[1:])) for row in cursor.fetchall()}
+
+def save_skid_context(conn, context):
+    """Write the context. The caller commits it together with the rows of the batch"""
+    conn.executemany(
+        f"INSERT OR REPLACE INTO skid_context (group_name, {', '.join(context_keys)}) VALUES (?, ?, ?, ?, ?)",
+        [(group_name, *(group_context.get(key) for key in context_keys)) for group_name, group_context in context.items()]
+    )
+
+def load_state(conn, key):
+    cursor = conn.cursor()
+    cursor.execute("SELECT value FROM analyzer_state WHERE key = ?", (key,))
+    row = cursor.fetchone()
+    return json.loads(row[0]) if row else None
+
+def save_state(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO analyzer_state (key, value) VALUES (?, ?)",
+                 (key, json.dumps(value, separators=(',', ':'))))
+
+def migrate_state_files(conn):
+    """Import skid_context.json and csv_checkpoint.json written by earlier versions"""
+    if load_state(conn, "state_files_migrated"):
+        return
+    if os.path.exists(settings.context_file):
         try:
-            with open(context_file, 'r') as f:
-                return json.load(f)
+            with open(settings.context_file, 'r') as f:
+                save_skid_context(conn, json.load(f))
+            print(f"Imported skid context from {settings.context_file}")
         except Exception as e:
             print(f"Error loading context file: {e}")
-            return {}
-    else:
-        return {}
+    if os.path.exists(settings.checkpoint_file):
+        try:
+            with open(settings.checkpoint_file, 'r') as f:
+                save_csv_checkpoint(conn, json.load(f))
+        except Exception as e:
+            print(f"Error loading checkpoint file: {e}")
+    save_state(conn, "state_files_migrated", True)
+
+# -----------------------------
+# Incremental CSV reading. index.js only ever appends to the chat log, so every run picks up at the byte offset where
+# the previous one stopped (saved in analyzer_state). The checkpoint also records which file that offset belongs to (inode, header and the
+# bytes just before the offset), so a log that was cleared by clearLogFile or replaced is read again from the header.
+# -----------------------------
+csv_columns = ["Group Name", "Sender Name", "Message", "Phone Number", "Date", "Time", "Message ID"]
+csv_chunk_bytes = 16 * 1024 * 1024  # New lines parsed, processed and committed at a time
+
+def load_csv_checkpoint(conn):
+    return load_state(conn, "csv_checkpoint") or {}
+
+def save_csv_checkpoint(conn, checkpoint):
+    save_state(conn, "csv_checkpoint", checkpoint)
+
+def _fingerprint(data):
+    return hashlib.sha1(data).hexdigest()
+
+def _read_tail(f, offset, length=64):
+    """Return up to `length` bytes ending at `offset`"""
+    start = max(offset - length, 0)
+    f.seek(start)
+    return f.read(offset - start)
+
+def parse_log_lines(data):
+    """Split complete chat log lines into a DataFrame of csv_columns.
+
+    The fields aren't quoted, a " in a message is just part of its text. index.js takes the commas out of the
+    messages, and the phone number, date, time and message id never have any, so a line with too many fields (a
+    sender's name with a comma, in logs written before index.js cleaned it) has the last five split off from the
+    right and the extra commas kept in the sender. No line can shift the columns of the others. Empty fields are None.
+    """
+    text = data.decode("utf-8", errors="replace").replace("\r\n", "\n")
+    rows = [line.split(",") for line in text.split("\n") if line]
+    for i, fields in enumerate(rows):
+        if len(fields) > len(csv_columns):
+            head, message, *tail = ",".join(fields).rsplit(",", len(csv_columns) - 2)
+            rows[i] = head.split(",", 1) + [message] + tail
+        elif len(fields) < len(csv_columns):
+            rows[i] = fields + [""] * (len(csv_columns) - len(fields))
+    df = pd.DataFrame(rows, columns=csv_columns, dtype=object)
+    return df.where(df != "", None)
+
+def iter_new_csv_rows(path, checkpoint, chunk_bytes=None):
+    """Yield (DataFrame, checkpoint) for the complete lines appended to the chat log since the checkpoint.
+
+    The new lines are read in chunks of about chunk_bytes (csv_chunk_bytes by default), so memory stays flat
+    however large the file is. Chunks end on record boundaries and each checkpoint points just past its chunk.
+    When there are no new lines, (None, checkpoint) is yielded so the caller still sees the checkpoint when the
+    log was reset, without loading pandas for nothing. A partially written last record is left for the next run.
+    """
+    chunk_bytes = chunk_bytes or csv_chunk_bytes
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        header = f.readline()
+        header_end = f.tell()
 
-def save_skid_context(context):
-    with open(context_file, 'w') as f:
-        json.dump(context, f, indent=4)
+        offset = checkpoint.get("offset", 0)
+        resume = (checkpoint.get("inode") == stat.st_ino and
+                  checkpoint.get("header_hash") == _fingerprint(header) and
+                  header_end <= offset <= stat.st_size and
+                  checkpoint.get("tail_hash") == _fingerprint(_read_tail(f, offset)))
+        if not resume:
+            if checkpoint:
+                print("Chat log was cleared or replaced since the last run. Reading it from the header.")
+            offset = header_end
+
+        identity = {
+            "inode": stat.st_ino,
+            "size": stat.st_size,
+            "header_hash": _fingerprint(header)
+        }
+
+        yielded = False
+        f.seek(offset)
+        while True:
+            started = time.perf_counter()
+            data = f.read(chunk_bytes)
+            # index.js writes one record per line (line breaks are taken out of the messages), so the chunk is
+            # extended to the end of the line it stops in
+            if data and not data.endswith(b"\n"):
+                data += f.readline()
+            # Whatever is left unterminated at the end of the file is still being written
+            if not data.endswith(b"\n"):
+                data = data[:data.rfind(b"\n") + 1]
+            if not data:
+                break
+
+            offset += len(data)
+            tail = data[-64:] if len(data) >= 64 else _read_tail(f, offset)
+            f.seek(offset)
+            new_checkpoint = dict(identity, offset=offset, tail_hash=_fingerprint(tail))
+            yielded = True
+            df = parse_log_lines(data)
+            metrics.inc("chat_csv_read_bytes_total", len(data))
+            metrics.observe("chat_csv_read_seconds", time.perf_counter() - started)
+            yield df, new_checkpoint
+
+        if not yielded:
+            new_checkpoint = dict(identity, offset=offset, tail_hash=_fingerprint(_read_tail(f, offset)))
+            yield None, new_checkpoint
+
+# -----------------------------
+# Connection profile applied to every connection the analyzer opens. In WAL mode the dashboards reading
+# whatsapp_logs.db and the analyzer writing to it no longer block each other.
+# -----------------------------
+sqlite_pragmas = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # Safe with WAL: a crash can't corrupt the database, a power cut may lose the last commits
+    "mmap_size": 256 * 1024 * 1024,  # Bytes of the database file read through memory mapping
+    "cache_size": -64 * 1024,  # Negative means KiB, so 64 MiB of page cache
+    "temp_store": "MEMORY",
+    "busy_timeout": 10000  # Milliseconds to wait for a lock held by another connection before failing
+}
+
+def connect_database(path=None, pragmas=None):
+    """Open the database with the connection profile (sqlite_pragmas unless `pragmas` is given) applied"""
+    conn = sqlite3.connect(path or settings.database_file)
+    for name, value in (sqlite_pragmas if pragmas is None else pragmas).items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
 
 # -----------------------------
 # Database setup functions
 # -----------------------------
-def initialize_database():
+def initialize_database(conn):
     """Create the database and tables if they don't exist"""
-    conn = sqlite3.connect(database_file)
     cursor = conn.cursor()
     
     # Create a groups table to keep track of all the groups
@@ -143,9 +372,13 @@ def initialize_database():
     for group_name in group_mappings.keys():
         cursor.execute("INSERT OR IGNORE INTO groups (name) VALUES (?)", (group_name,))
     
-    # Commit and close
+    # Skid context and analyzer state
+    create_state_tables(conn)
+    migrate_state_files(conn)
+    create_rollup_tables(conn)
+    create_skid_sessions_table(conn)
+    
     conn.commit()
-    conn.close()
 
 def create_group_table(conn, group_name):
     """Create a table for a specific group if it doesn't exist"""
@@ -162,6 +395,9 @@ def create_group_table(conn, group_name):
         "id INTEGER PRIMARY KEY AUTOINCREMENT",
         "date TEXT",
         "time TEXT",
+        "event_ts TEXT",
+        "msg_key TEXT",
+        "msg_id TEXT",
         "is_new_skid TEXT",
         "skid_baseline_flow REAL",
         "decanted_volume REAL"
@@ -173,8 +409,7 @@ def create_group_table(conn, group_name):
         col_name = sanitize_column_name(param)
         
         # Determine column type based on parameter
-        if param in ['Skid in use', 'Standby skid', 'Empty skid', 'Decanting', 
-                    'Standby', 'Empty', 'Skid No', 'In transit']:
+        if param in text_params:
             col_type = "TEXT"
         else:
             col_type = "REAL"
@@ -192,6 +427,8 @@ def create_group_table(conn, group_name):
     try:
         cursor = conn.cursor()
         cursor.execute(create_table_sql)
+        migrate_event_ts(conn, table_name)
+        migrate_msg_key(conn, table_name)
         conn.commit()
         print(f"Created or verified table for group: {group_name}")
         return True
@@ -200,6 +437,63 @@ def create_group_table(conn, group_name):
         conn.rollback()
         return False
 
+def migrate_event_ts(conn, table_name):
+    """Add the event_ts column and its index to a table created by an earlier version, filling it for existing rows"""
+    cursor = conn.cursor()
+    cursor.execute(f'PRAGMA table_info("{table_name}")')
+    if "event_ts" not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE "{table_name}" ADD COLUMN event_ts TEXT')
+        backfill_event_ts(conn, table_name)
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS "{table_name}_event_ts" ON "{table_name}" (event_ts)')
+
+def migrate_msg_key(conn, table_name):
+    """Move a table from deduplication on UNIQUE(date, time) to the msg_id and msg_key indexes.
+
+    msg_id is unique. msg_key is only unique among rows without a msg_id, with a plain index for looking up rows of
+    either kind by it. Rows stored before have no key (their message text was never stored) and keep NULL. New rows
+    are still checked against them by date and time, through a partial index that only holds those rows.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f'PRAGMA table_info("{table_name}")')
+    existing = [column[1] for column in cursor.fetchall()]
+    if "msg_key" not in existing:
+        cursor.execute(f'ALTER TABLE "{table_name}" ADD COLUMN msg_key TEXT')
+        cursor.execute(f'ALTER TABLE "{table_name}" ADD COLUMN msg_id TEXT')
+    cursor.execute(f'DROP INDEX IF EXISTS "{table_name}_date_time"')
+    # Earlier versions made msg_key unique for every row, which dropped distinct messages with the same text
+    cursor.execute(f'PRAGMA index_list("{table_name}")')
+    if any(index[1] == f"{table_name}_msg_key" and index[2] for index in cursor.fetchall()):
+        cursor.execute(f'DROP INDEX "{table_name}_msg_key"')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS "{table_name}_msg_key" ON "{table_name}" (msg_key)')
+    cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{table_name}_msg_key_without_id" ON "{table_name}" (msg_key) '
+                   f'WHERE msg_id IS NULL')
+    cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{table_name}_msg_id" ON "{table_name}" (msg_id)')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS "{table_name}_legacy_date_time" ON "{table_name}" (date, time) '
+                   f'WHERE msg_key IS NULL')
+
+def backfill_event_ts(conn, table_name, chunk_rows=100000):
+    """Parse event_ts for the rows of a table that don't have one yet. Returns the number of rows filled in."""
+    cursor = conn.cursor()
+    filled = 0
+    last_id = 0
+    while True:
+        # Walk the rows by id so rows that still fail to parse aren't read again
+        cursor.execute(f'SELECT id, date, time FROM "{table_name}" WHERE event_ts IS NULL AND id > ? '
+                       f'ORDER BY id LIMIT ?', (last_id, chunk_rows))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        chunk = pd.DataFrame(rows, columns=["id", "date", "time"])
+        chunk["event_ts"] = parse_event_ts(chunk["date"], chunk["time"])
+        chunk = chunk[chunk["event_ts"].notna()]
+        cursor.executemany(f'UPDATE "{table_name}" SET event_ts = ? WHERE id = ?',
+                           zip(chunk["event_ts"], chunk["id"].tolist()))
+        filled += len(chunk)
+    if filled:
+        print(f"Filled in event_ts for {filled} rows of {table_name}")
+    return filled
+
 def sanitize_table_name(name):
     """Convert a group name to a valid SQLite table name"""
     # Replace spaces and invalid characters with underscores
@@ -220,21 +514,184 @@ def sanitize_column_name(name):
         sanitized = f"c_{sanitized}"
     return sanitized
 
+# -----------------------------
+# Timestamps
+# -----------------------------
+def parse_event_ts(dates, times, fmt=None):
+    """Parse Series of logged dates and times into event_ts strings, None where they don't match the format"""
+    # Newer Node versions put a narrow no-break space before AM/PM
+    stamps = (dates.astype(str) + " " + times.astype(str)).str.replace("\u202f", " ", regex=False)
+    parsed = pd.to_datetime(stamps, format=fmt or timestamp_format, errors='coerce')
+    return parsed.dt.strftime("%Y-%m-%d %H:%M:%S").astype(object).where(parsed.notna(), None)
+
+# -----------------------------
+# Idempotency keys. Every stored row carries msg_key, a hash of the message, and msg_id, WhatsApp's message id where
+# the source has one (the chat log and the ingest server, not chat exports). msg_id is the identity of a message that
+# has one. The hash only stands in for rows without an id: two messages with different ids are different messages
+# even when their group, minute and text hash the same. A message is stored once however often and from whichever
+# source it is read (see insert_data_to_db).
+# -----------------------------
+key_columns = ["msg_key", "msg_id"]
+
+def message_keys(group_name, event_ts, dates, times, messages):
+    """Return the msg_key of each message.
+
+    The key has to come out the same for the chat log, the ingest server and chat exports. Exports only give the
+    minute a message was posted and the sender's name as saved on the phone, and index.js drops commas and line breaks
+    from the messages it writes to the CSV. So the key hashes the group, the minute of event_ts (the logged date and
+    time if it couldn't be parsed) and the message without commas and with runs of whitespace as one space.
+    """
+    keys = []
+    for stamp, date, time_str, message in zip(event_ts, dates, times, messages):
+        stamp = stamp[:16] if stamp else f"{date} {time_str}"
+        body = " ".join(str(message).replace(",", "").split())
+        keys.append(hashlib.blake2b(f"{group_name}\x1f{stamp}\x1f{body}".encode("utf-8"), digest_size=16).hexdigest())
+    return keys
+
+def message_ids(df_group):
+    """WhatsApp message ids of a chat log frame, None where the source had none"""
+    if "Message ID" not in df_group.columns:
+        return [None] * len(df_group)
+    return [value if isinstance(value, str) and value else None for value in df_group["Message ID"].tolist()]
+
+# -----------------------------
+# Compiled extractors. Each mapping is compiled once instead of every pattern being looked up in the re cache for
+# every message.
+# -----------------------------
+def line_break_tolerant(pattern):
+    """Rewrite a mapping pattern so it matches messages whose line breaks were never replaced by spaces.
+
+    Every literal space outside a character class also matches a line break, and '.' matches line breaks too
+    (compile with re.DOTALL). The messages are used as logged instead of running a replace over every one.
+    """
+    parts = []
+    in_class = False
+    escaped = False
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif in_class:
+            in_class = char != "]"
+        elif char == "[":
+            in_class = True
+        elif char == " ":
+            char = r"(?: |\r?\n)"
+        parts.append(char)
+    return "".join(parts)
+
+def required_literal(pattern):
+    """Return the literal text every match of a pattern starts with ("Inlet pressure" for r"Inlet pressure:? ?(...)"),
+    lowercased. Empty if the pattern doesn't start with one or has a top level alternative."""
+    depth = 0
+    escaped = False
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return ""
+    literal = []
+    for char in pattern:
+        if char in "?*{":
+            # The character before is optional
+            literal = literal[:-1]
+            break
+        if char in "\\()[].^$|+":
+            break
+        literal.append(char)
+    return "".join(literal).lower()
+
+# Characters re.IGNORECASE matches to an ASCII letter that str.lower() doesn't turn into that letter
+# (U+0130 dotted capital I, U+0131 dotless i, U+017F long s)
+casefold_exceptions = re.compile("[\u0130\u0131\u017f]")
+
+class ParameterExtractor:
+    """Compiled form of a parameter mapping"""
+
+    def __init__(self, param_mapping):
+        self.param_mapping = param_mapping
+        self.keys = list(param_mapping.keys())
+        # Case insensitive like the original re.search calls
+        self.patterns = [(key, re.compile(line_break_tolerant(pattern), re.IGNORECASE | re.DOTALL))
+                         for key, pattern in param_mapping.items()]
+        # Bound search methods for the per-message path
+        self._searches = [(key, compiled.search) for key, compiled in self.patterns]
+        # Label each pattern needs to match, used by prefilter
+        self.labels = {key: required_literal(pattern) for key, pattern in param_mapping.items()}
+
+    def prefilter(self, messages, needed=3, keep=()):
+        """Return a boolean array, False for the messages no pattern needs to run on.
+
+        A message passes if it holds the labels of at least `needed` parameters or the label of any parameter in
+        `keep`. The labels are looked for in the lowercased message with line breaks as spaces, which finds every
+        label the case insensitive patterns could match. Messages with characters lower() treats differently
+        from re.IGNORECASE always pass.
+        """
+        keep_labels = [self.labels[key] for key in keep]
+        labels = [label for label in self.labels.values() if label]
+        unlabelled = len(self.labels) - len(labels)
+        if unlabelled >= needed or not all(keep_labels):
+            return np.ones(len(messages), dtype=bool)
+        needed -= unlabelled
+        exception = casefold_exceptions.search
+
+        def passes(message):
+            if not isinstance(message, str):
+                return False
+            text = message.lower()
+            if "\n" in text:
+                text = text.replace("\r\n", " ").replace("\n", " ")
+            contains = text.__contains__
+            return (any(map(contains, keep_labels)) or sum(map(contains, labels)) >= needed or
+                    exception(message) is not None)
+
+        # A plain list iterates much faster than a Series
+        if isinstance(messages, pd.Series):
+            messages = messages.tolist()
+        return np.fromiter(map(passes, messages), dtype=bool, count=len(messages))
+
+    def extract(self, message_text):
+        """Return {parameter: captured text or None} for one message"""
+        results = {}
+        for key, search in self._searches:
+            m = search(message_text)
+            results[key] = m.group(1) if m else None
+        return results
+
+_extractors = {}
+
+def get_extractor(param_mapping):
+    """Return the compiled extractor for a mapping, building it the first time the mapping is used"""
+    extractor = _extractors.get(id(param_mapping))
+    if extractor is None or extractor.param_mapping is not param_mapping:
+        extractor = ParameterExtractor(param_mapping)
+        _extractors[id(param_mapping)] = extractor
+    return extractor
+
 # -----------------------------
 # Extraction function using the provided mapping.
 # -----------------------------
 def extract_parameters(message_text, param_mapping):
-    results = {}
-    for key, pattern in param_mapping.items():
-        # Add re.IGNORECASE flag to make the pattern case insensitive
-        m = re.search(pattern, message_text, re.IGNORECASE)
-        results[key] = m.group(1) if m else None
-    return results
+    return get_extractor(param_mapping).extract(message_text)
 
 # -----------------------------
 # Processing function which incorporates skid tracking
 # -----------------------------
-def process_group(df_group, group_name, skid_context):
+prefilter_messages = True  # Skip the patterns for messages that can't hold readings (see ParameterExtractor.prefilter)
+
+def process_group(df_group, group_name, skid_context, columnar=True):
+    """Extract readings for one group and track skid changes.
+
+    columnar=True runs every pattern over the whole message column at once and only keeps the skid tracking
+    sequential. columnar=False processes the messages one row at a time.
+    """
     # Get the appropriate configuration for this group
     if group_name not in group_mappings:
         print(f"No parameter mapping defined for group '{group_name}'. Skipping.")
@@ -244,6 +701,7 @@ def process_group(df_group, group_name, skid_context):
     param_mapping = config['params']
     pressure_field = config['pressure_field']
     flow_field = config['flow_field']
+    extractor = get_extractor(param_mapping)
     
     # Initialize context for this group if it doesn't exist or ensure all keys are present
     if group_name not in skid_context:
@@ -257,12 +715,27 @@ def process_group(df_group, group_name, skid_context):
     
     group_context = skid_context[group_name]
     processed_rows = []
+    kept_messages = []
+    kept_ids = []
     
     pressure_threshold = 5  # This figure is chosen arbitrarily and can be adjusted as needed. Pressure increase == New Skid
     
-    for idx, row in df_group.iterrows():
-        message = row['Message']
-        params = extract_parameters(message, param_mapping)
+    # Messages without the labels of 3 parameters nor a pressure or flow label can't give a row or move the skid
+    # tracking, so they are dropped before any pattern runs
+    if prefilter_messages:
+        passed = extractor.prefilter(df_group['Message'], keep=(pressure_field, flow_field))
+        metrics.inc("chat_prefilter_passed_total", int(passed.sum()), group_name)
+        metrics.inc("chat_prefilter_rejected_total", len(passed) - int(passed.sum()), group_name)
+        if not passed.all():
+            df_group = df_group[passed]
+    
+    if columnar:
+        return process_group_columnar(df_group, group_name, config, group_context, pressure_threshold)
+    
+    ids = message_ids(df_group)
+    for position, (idx, row) in enumerate(df_group.iterrows()):
+        message = str(row['Message'])
+        params = extractor.extract(message)
         
         # Extract and convert critical values
         current_total_flow = params.get(flow_field)
@@ -308,7 +781,7 @@ def process_group(df_group, group_name, skid_context):
         for key, value in params.items():
             try:
                 # Keep some fields as strings
-                if key not in ['Skid in use', 'Standby skid', 'Empty skid', 'Decanting', 'Standby', 'Empty', 'Skid No', 'In transit']:
+                if key not in text_params:
                     params[key] = float(value) if value is not None else None
             except ValueError:
                 params[key] = None
@@ -329,160 +802,1373 @@ def process_group(df_group, group_name, skid_context):
             }
             new_row.update(params)
             processed_rows.append(new_row)
+            kept_messages.append(message)
+            kept_ids.append(ids[position])
     
     # Return processed DataFrame
-    return pd.DataFrame(processed_rows) if processed_rows else None
+    if not processed_rows:
+        return None
+    processed = pd.DataFrame(processed_rows)
+    event_ts = parse_event_ts(processed["date"], processed["time"]).to_numpy()
+    processed.insert(2, "event_ts", event_ts)
+    processed.insert(3, "msg_key", message_keys(group_name, event_ts, processed["date"], processed["time"], kept_messages))
+    processed.insert(4, "msg_id", kept_ids)
+    return processed
+
+# -----------------------------
+# Columnar processing. Patterns run over the whole message column, only the skid tracking stays sequential
+# -----------------------------
+def extract_columns(messages, param_mapping):
+    """Run every pattern of a mapping over a Series of messages, one column per parameter"""
+    extracted = pd.DataFrame(index=messages.index)
+    for key, compiled in get_extractor(param_mapping).patterns:
+        extracted[key] = messages.str.extract(compiled, expand=False)
+    return extracted
+
+def track_skids(pressures, flows, stamps, group_context, pressure_threshold):
+    """Run the skid state machine over arrays of pressure and total flow readings (NaN where missing).
+
+    Returns (is_new_skid, skid_baseline_flow, decanted_volume) arrays and updates group_context in place.
+    """
+    count = len(pressures)
+    is_new_skid = np.zeros(count, dtype=bool)
+    baseline_flows = np.full(count, np.nan)
+    decanted_volumes = np.full(count, np.nan)
+
+    last_pressure = group_context["last_pressure"]
+    last_total_flow = group_context["last_total_flow"]
+    baseline_flow = group_context["skid_baseline_flow"]
+
+    for i in range(count):
+        current_pressure = pressures[i] if pressures[i] == pressures[i] else None
+        current_total_flow = flows[i] if flows[i] == flows[i] else None
+
+        # Check for new skid (significant pressure increase)
+        if (current_pressure is not None and
+            last_pressure is not None and
+            current_pressure > last_pressure + pressure_threshold):
+            is_new_skid[i] = True
+            baseline_flow = last_total_flow
+            group_context["last_skid_change"] = stamps[i]
+
+        # Instanteneous Meter Reading - Meter reading at the start of the skid decanting
+        if current_total_flow is not None and baseline_flow is not None:
+            decanted_volumes[i] = current_total_flow - baseline_flow
+
+        if current_pressure is not None:
+            last_pressure = current_pressure
+        if current_total_flow is not None:
+            last_total_flow = current_total_flow
+
+        # Initialize baseline flow if this is the first record with valid flow
+        if baseline_flow is None and current_total_flow is not None:
+            baseline_flow = current_total_flow
+
+        if baseline_flow is not None:
+            baseline_flows[i] = baseline_flow
+
+    group_context["last_pressure"] = None if last_pressure is None else float(last_pressure)
+    group_context["last_total_flow"] = None if last_total_flow is None else float(last_total_flow)
+    group_context["skid_baseline_flow"] = None if baseline_flow is None else float(baseline_flow)
+    return is_new_skid, baseline_flows, decanted_volumes
+
+def track_skids_vectorized(pressures, flows, stamps, group_context, pressure_threshold):
+    """Array version of track_skids, giving the same output without a Python loop over the rows.
+
+    A new skid starts wherever the pressure jumps above the last non-null pressure (seeded from the context).
+    The cumulative sum of those jumps numbers the skid segments, and each segment's baseline is the last
+    flow before its jump, or the first flow reading inside it when there was none.
+    """
+    count = len(pressures)
+    if count == 0:
+        return np.zeros(0, dtype=bool), np.full(0, np.nan), np.full(0, np.nan)
+
+    def seed(value):
+        return np.nan if value is None else float(value)
+
+    pressures = pd.Series(pressures, dtype='float64')
+    flows = pd.Series(flows, dtype='float64')
+
+    # Last non-null reading before each row, starting from the persisted context
+    previous_pressure = pd.Series(np.concatenate(([seed(group_context["last_pressure"])], pressures.to_numpy()[:-1]))).ffill()
+    previous_flow = pd.Series(np.concatenate(([seed(group_context["last_total_flow"])], flows.to_numpy()[:-1]))).ffill()
+
+    # NaN on either side compares False, same as the None checks in the loop
+    is_new_skid = (pressures > previous_pressure + pressure_threshold).to_numpy()
+    segment = np.cumsum(is_new_skid)
+
+    # Baseline each segment starts with: the stored one for the first segment, the flow before the jump for the rest
+    start_baseline = np.concatenate(([seed(group_context["skid_baseline_flow"])], previous_flow.to_numpy()[is_new_skid]))[segment]
+
+    # A segment that starts without a baseline takes its first flow reading, which applies from that row onwards
+    # for the stored baseline and from the row after it for the decanted volume
+    has_flow = flows.notna()
+    flows_seen = has_flow.groupby(segment).cumsum().to_numpy()
+    first_flow = flows.groupby(segment).transform('first').to_numpy()
+    no_baseline = np.isnan(start_baseline)
+    baseline_flows = np.where(no_baseline & (flows_seen > 0), first_flow, start_baseline)
+    baseline_before = np.where(no_baseline & (flows_seen - has_flow.to_numpy() > 0), first_flow, start_baseline)
+    decanted_volumes = flows.to_numpy() - baseline_before
+
+    # Carry the state forward for the next batch
+    last_pressure_index = pressures.last_valid_index()
+    if last_pressure_index is not None:
+        group_context["last_pressure"] = float(pressures[last_pressure_index])
+    last_flow_index = flows.last_valid_index()
+    if last_flow_index is not None:
+        group_context["last_total_flow"] = float(flows[last_flow_index])
+    group_context["skid_baseline_flow"] = None if np.isnan(baseline_flows[-1]) else float(baseline_flows[-1])
+    if is_new_skid.any():
+        group_context["last_skid_change"] = stamps[np.flatnonzero(is_new_skid)[-1]]
+    return is_new_skid, baseline_flows, decanted_volumes
+
+def process_group_columnar(df_group, group_name, config, group_context, pressure_threshold):
+    """Columnar version of the per-row loop in process_group, giving the same rows and context"""
+    param_mapping = config['params']
+    pressure_field = config['pressure_field']
+    flow_field = config['flow_field']
+
+    messages = df_group['Message'].astype(str)
+    extracted = extract_columns(messages, param_mapping)
+
+    # Convert all numeric parameters in bulk. Values float() can't parse become NaN just like they became None
+    params = pd.DataFrame(index=extracted.index)
+    for key in param_mapping:
+        if key in text_params:
+            params[key] = extracted[key]
+        else:
+            params[key] = pd.to_numeric(extracted[key], errors='coerce').astype('float64')
+
+    # Skid tracking uses pressure and flow together: if either fails to convert both are ignored for that message
+    pressures = pd.to_numeric(extracted[pressure_field], errors='coerce').astype('float64')
+    flows = pd.to_numeric(extracted[flow_field], errors='coerce').astype('float64')
+    unparsable = ((extracted[pressure_field].notna() & pressures.isna()) |
+                  (extracted[flow_field].notna() & flows.isna()))
+    pressures[unparsable] = np.nan
+    flows[unparsable] = np.nan
+
+    dates = df_group.iloc[:, 4]
+    times = df_group.iloc[:, 5]
+    stamps = (dates.astype(str) + " " + times.astype(str)).to_numpy()
+    is_new_skid, baseline_flows, decanted_volumes = track_skids_vectorized(
+        pressures.to_numpy(), flows.to_numpy(), stamps, group_context, pressure_threshold)
+
+    # Only add records (rows) with valid data
+    valid = (params.notna().sum(axis=1) >= 3).to_numpy()
+    if not valid.any():
+        return None
+
+    event_ts = parse_event_ts(dates[valid], times[valid]).to_numpy()
+    processed = pd.DataFrame({
+        "date": dates.to_numpy()[valid],
+        "time": times.to_numpy()[valid],
+        "event_ts": event_ts,
+        "msg_key": message_keys(group_name, event_ts, dates.to_numpy()[valid], times.to_numpy()[valid],
+                                messages.to_numpy()[valid]),
+        "msg_id": np.array(message_ids(df_group), dtype=object)[valid],
+        "is_new_skid": np.where(is_new_skid[valid], "Yes", "No"),
+        "skid_baseline_flow": baseline_flows[valid],
+        "decanted_volume": decanted_volumes[valid]
+    })
+    for key in param_mapping:
+        processed[key] = params[key].to_numpy()[valid]
+    return processed
 
 # -----------------------------
 # Database insertion function
 # -----------------------------
-def insert_data_to_db(conn, group_name, df):
-    """Insert processed data into the database"""
+def group_columns(group_name):
+    """Data columns of a group table in table order, named as in the processed DataFrame"""
+    columns = ["date", "time", "event_ts"] + key_columns + ["is_new_skid", "skid_baseline_flow", "decanted_volume"]
+    if group_name in group_mappings:
+        columns += list(group_mappings[group_name]['params'].keys())
+    return columns
+
+def insert_data_to_db(conn, group_name, df, commit=True):
+    """Insert processed data into the database in one transaction.
+
+    Every row uses the same column list (missing values are stored as NULL) so all rows go through a single
+    executemany. A row with a msg_id is skipped when that id is stored. A row without one is skipped when a row with
+    its msg_key is stored. When a row with a msg_id matches a stored row without an id by msg_key (an imported chat
+    export overlapping the chat log), the stored row is given the id instead, one stored row per message. With
+    commit=False the rows are left in the open transaction for the caller to commit. Returns (rows_inserted, rows_skipped).
+    """
     if df is None or df.empty:
         print(f"No data to insert for group '{group_name}'")
-        return 0
+        return 0, 0
     
     table_name = sanitize_table_name(group_name)
     cursor = conn.cursor()
-    rows_inserted = 0
     
-    # Check for existing entries to avoid duplicates
-    existing_entries = set()
-    try:
-        cursor.execute(f'SELECT date, time FROM "{table_name}"')
-        existing_entries = set((row[0], row[1]) for row in cursor.fetchall())
-    except sqlite3.OperationalError:
-        # Table might not exist yet
-        pass
-    
-    for _, row in df.iterrows():
-        # Skip if this date/time combination already exists
-        if (row['date'], row['time']) in existing_entries:
-            continue
-        
-        # Prepare column names and placeholders
-        columns = []
-        placeholders = []
-        values = []
-        
-        for col, val in row.items():
-            if val is not None:  # Only include non-null values
-                columns.append(sanitize_column_name(col))
-                placeholders.append('?')
-                values.append(val)
-        
-        # Skip if no valid columns
-        if not columns:
-            continue
-        
-        # Construct and execute INSERT query
-        query = f'INSERT INTO "{table_name}" ({", ".join(columns)}) VALUES ({", ".join(placeholders)})'
-        try:
-            cursor.execute(query, values)
-            rows_inserted += 1
-        except Exception as e:
-            print(f"Error inserting row: {e}")
-            conn.rollback()
+    # One fixed column list for the whole batch, NaN/None become NULL
+    columns = [col for col in group_columns(group_name) if col in df.columns]
+    batch = df[columns].astype(object)
+    batch = batch.where(batch.notna(), None)
     
+    # Rows with a stored msg_id are dropped by its UNIQUE index, rows without one look their msg_key up. Only the
+    # lookup needs the INSERT ... SELECT form, which SQLite runs through a temporary table as it reads the table it
+    # writes, so rows with an id use a plain VALUES insert
+    names = ", ".join(sanitize_column_name(col) for col in columns)
+    placeholders = ", ".join("?" for _ in columns)
+    with_id_query = f'INSERT OR IGNORE INTO "{table_name}" ({names}) VALUES ({placeholders})'
+    without_id_query = (f'INSERT OR IGNORE INTO "{table_name}" ({names}) SELECT {placeholders} '
+                        f'WHERE NOT EXISTS (SELECT 1 FROM "{table_name}" WHERE msg_key = ?)')
+    key_index, id_index = columns.index("msg_key"), columns.index("msg_id")
+    legacy_columns = []
+    if conn.execute(f'SELECT 1 FROM "{table_name}" WHERE msg_key IS NULL LIMIT 1').fetchone():
+        # Rows stored before msg_key existed have none, they are matched by date and time like they used to be
+        legacy = (f'NOT EXISTS (SELECT 1 FROM "{table_name}" INDEXED BY "{table_name}_legacy_date_time" '
+                  f'WHERE msg_key IS NULL AND date = ? AND time = ?)')
+        with_id_query = f'INSERT OR IGNORE INTO "{table_name}" ({names}) SELECT {placeholders} WHERE {legacy}'
+        without_id_query += f' AND {legacy}'
+        legacy_columns = [columns.index("date"), columns.index("time")]
+    rows = list(batch.itertuples(index=False, name=None))
+    # Consecutive rows of the same kind go in together, so the rows keep their order in the table
+    runs = []
+    for has_id, run in itertools.groupby(rows, key=lambda row: row[id_index] is not None):
+        extra = ([] if has_id else [key_index]) + legacy_columns
+        runs.append((with_id_query if has_id else without_id_query,
+                     [row + tuple(row[i] for i in extra) for row in run] if extra else list(run)))
+
+    # Stored rows without an id (from chat exports) that a row with an id matches by msg_key take its id, each one
+    # only once, so the insert below skips that row and a second message with the same text is still stored
+    claims = []
+    if conn.execute(f'SELECT 1 FROM "{table_name}" INDEXED BY "{table_name}_msg_key_without_id" '
+                    f'WHERE msg_id IS NULL AND msg_key IS NOT NULL LIMIT 1').fetchone():
+        claims = [(row[id_index], row[key_index], row[id_index]) for row in rows if row[id_index] is not None]
+    claim_query = (f'UPDATE "{table_name}" SET msg_id = ? WHERE id = '
+                   f'(SELECT id FROM "{table_name}" WHERE msg_key = ? AND msg_id IS NULL ORDER BY id LIMIT 1) '
+                   f'AND NOT EXISTS (SELECT 1 FROM "{table_name}" WHERE msg_id = ?)')
+    # A savepoint undoes just this group's rows on error, without touching the rest of the caller's transaction
+    if not conn.in_transaction:
+        cursor.execute("BEGIN")
+    cursor.execute("SAVEPOINT insert_group")
+    try:
+        cursor.executemany(claim_query, claims)
+        changes_before = conn.total_changes
+        for query, run in runs:
+            cursor.executemany(query, run)
+        cursor.execute("RELEASE insert_group")
+    except Exception as e:
+        print(f"Error inserting rows for group '{group_name}': {e}")
+        cursor.execute("ROLLBACK TO insert_group")
+        cursor.execute("RELEASE insert_group")
+        if commit:
+            conn.commit()
+        return 0, len(df)
+    rows_inserted = conn.total_changes - changes_before
+    if commit:
+        conn.commit()
+    return rows_inserted, len(df) - rows_inserted
+
+# -----------------------------
+# Hourly and daily rollups of each group's pressure_field and flow_field. The buckets new rows fall into are recomputed
+# in the same transaction that inserts them, using the last rolled up id of each table as a watermark.
+# -----------------------------
+rollup_buckets = {
+    "rollup_hourly": "substr(event_ts, 1, 13) || ':00:00'",  # "YYYY-MM-DD HH:00:00"
+    "rollup_daily": "substr(event_ts, 1, 10)"  # "YYYY-MM-DD"
+}
+# Start of the bucket after a.bucket, the rows of a bucket are the event_ts range [bucket, bucket end)
+rollup_bucket_ends = {
+    "rollup_hourly": "datetime(a.bucket, '+1 hour')",
+    "rollup_daily": "date(a.bucket, '+1 day')"
+}
+rollup_recompute_buckets = 500  # Buckets recomputed per statement
+
+def create_rollup_tables(conn):
+    """Create the rollup tables. Averages are pressure_sum / pressure_count, flow deltas flow_max - flow_min."""
+    for rollup_table in rollup_buckets:
+        conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {rollup_table} (
+            group_name TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            readings INTEGER NOT NULL,
+            pressure_min REAL,
+            pressure_max REAL,
+            pressure_sum REAL,
+            pressure_count INTEGER NOT NULL,
+            flow_min REAL,
+            flow_max REAL,
+            skid_changes INTEGER NOT NULL,
+            decanted_volume REAL,
+            PRIMARY KEY (group_name, bucket)
+        )
+        ''')
+
+def rollup_merge(column, function):
+    """ON CONFLICT expression merging a min/max column. SQLite's min()/max() of a NULL are NULL, so NULLs are skipped"""
+    return (f"{column} = {function}(COALESCE({column}, excluded.{column}), "
+            f"COALESCE(excluded.{column}, {column}))")
+
+def update_rollups(conn, group_name):
+    """Recompute the rollup buckets touched by a group's rows stored since the last update. Doesn't commit.
+
+    decanted_volume adds up the volume of every skid that was finished in the bucket, i.e. the decanted_volume of
+    the reading before each skid change in event_ts order. Rows come in out of order (chat exports, messages the
+    ingest server missed), so every bucket that holds a new row is recomputed from all of its rows, and so is the
+    bucket of the reading after each new row, whose skid change may now finish a different skid. Rows without
+    an event_ts are left out.
+    """
+    if group_name not in group_mappings:
+        return
+    config = group_mappings[group_name]
+    table_name = sanitize_table_name(group_name)
+    pressure = sanitize_column_name(config['pressure_field'])
+    flow = sanitize_column_name(config['flow_field'])
+    state_key = f"rollup_watermark:{table_name}"
+    watermark = load_state(conn, state_key) or 0
+
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT MAX(id) FROM "{table_name}"')
+    last_id = cursor.fetchone()[0]
+    if last_id is None or last_id <= watermark:
+        return
+
+    for rollup_table, bucket in rollup_buckets.items():
+        cursor.execute(f'''
+        SELECT DISTINCT {bucket} FROM (
+            SELECT event_ts FROM "{table_name}" WHERE id > ? AND id <= ? AND event_ts IS NOT NULL
+            UNION ALL
+            SELECT (SELECT n.event_ts FROM "{table_name}" n
+                    WHERE n.event_ts IS NOT NULL AND (n.event_ts, n.id) > (r.event_ts, r.id)
+                    ORDER BY n.event_ts, n.id LIMIT 1)
+            FROM "{table_name}" r WHERE r.id > ? AND r.id <= ? AND r.event_ts IS NOT NULL
+        ) WHERE event_ts IS NOT NULL
+        ''', (watermark, last_id, watermark, last_id))
+        buckets = [row[0] for row in cursor.fetchall()]
+
+        for start in range(0, len(buckets), rollup_recompute_buckets):
+            chunk = buckets[start:start + rollup_recompute_buckets]
+            placeholders = ", ".join("(?)" for _ in chunk)
+            cursor.execute(f'DELETE FROM {rollup_table} WHERE group_name = ? AND bucket IN ({", ".join("?" for _ in chunk)})',
+                           [group_name] + chunk)
+            # The reading before a skid change is looked up through the event_ts index, it may be in an earlier bucket
+            cursor.execute(f'''
+            WITH affected (bucket) AS (VALUES {placeholders})
+            INSERT INTO {rollup_table} (group_name, bucket, readings, pressure_min, pressure_max, pressure_sum,
+                                        pressure_count, flow_min, flow_max, skid_changes, decanted_volume)
+            SELECT ?, a.bucket, COUNT(*), MIN(r.{pressure}), MAX(r.{pressure}), SUM(r.{pressure}), COUNT(r.{pressure}),
+                   MIN(r.{flow}), MAX(r.{flow}), SUM(r.is_new_skid = 'Yes'),
+                   SUM(CASE WHEN r.is_new_skid = 'Yes' THEN
+                       (SELECT p.decanted_volume FROM "{table_name}" p
+                        WHERE p.event_ts IS NOT NULL AND (p.event_ts, p.id) < (r.event_ts, r.id)
+                        ORDER BY p.event_ts DESC, p.id DESC LIMIT 1) END)
+            FROM affected a
+            JOIN "{table_name}" r ON r.event_ts >= a.bucket AND r.event_ts < {rollup_bucket_ends[rollup_table]}
+            GROUP BY a.bucket
+            ''', chunk + [group_name])
+    save_state(conn, state_key, last_id)
+
+def rebuild_rollups():
+    """Regenerate the rollup tables from the stored rows of every group"""
+    conn = connect_database()
+    initialize_database(conn)
+    try:
+        for rollup_table in rollup_buckets:
+            conn.execute(f"DELETE FROM {rollup_table}")
+        conn.execute("DELETE FROM analyzer_state WHERE key LIKE 'rollup_watermark:%'")
+        for group_name in group_mappings:
+            table_name = sanitize_table_name(group_name)
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone():
+                create_group_table(conn, group_name)
+                update_rollups(conn, group_name)
+                print(f"Rebuilt rollups for group: {group_name}")
+        conn.commit()
+    finally:
+        conn.close()
+
+# -----------------------------
+# Skid sessions: one row per skid from the row marked is_new_skid to the row before the next one, in event_ts order.
+# Rows stored before a group's first skid change form its first session. Kept up to date with the same kind of id
+# watermark as the rollups.
+# -----------------------------
+skid_session_chunk_rows = 100000  # Rows read at a time when a whole table is replayed
+
+def create_skid_sessions_table(conn):
+    """Create the skid_sessions table. start_id/end_id are the ids of the session's first and last row."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS skid_sessions (
+        group_name TEXT NOT NULL,
+        start_id INTEGER NOT NULL,
+        end_id INTEGER NOT NULL,
+        start_ts TEXT,
+        end_ts TEXT,
+        skid_id TEXT,
+        baseline_flow REAL,
+        final_flow REAL,
+        delivered_volume REAL,
+        pressure_min REAL,
+        pressure_max REAL,
+        readings INTEGER NOT NULL,
+        PRIMARY KEY (group_name, start_id)
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS skid_sessions_start_ts ON skid_sessions (group_name, start_ts)")
+
+def update_skid_sessions(conn, group_name, chunk_rows=None):
+    """Bring a group's skid sessions up to date with the rows stored since the last update. Doesn't commit.
+
+    Rows are taken in (event_ts, id) order, rows without an event_ts are left out. New rows that all come after the
+    latest session extend it. Rows that land earlier (chat exports, messages the ingest server missed) can split or
+    merge sessions, so the session they fall in and every later one are deleted and replayed from the stored rows.
+    delivered_volume is the last decanted_volume of the session and final_flow its last flow reading, skid_id the
+    first value of the group's skid_field.
+    """
+    if group_name not in group_mappings:
+        return
+    config = group_mappings[group_name]
+    table_name = sanitize_table_name(group_name)
+    pressure = sanitize_column_name(config['pressure_field'])
+    flow = sanitize_column_name(config['flow_field'])
+    skid = sanitize_column_name(config['skid_field']) if config.get('skid_field') else "NULL"
+    state_key = f"skid_session_watermark:{table_name}"
+    watermark = load_state(conn, state_key) or 0
+    cursor = conn.cursor()
+
+    cursor.execute(f'SELECT MAX(id) FROM "{table_name}"')
+    last_id = cursor.fetchone()[0]
+    if last_id is None or last_id <= watermark:
+        return
+    cursor.execute(f'''
+    SELECT event_ts, id FROM "{table_name}" WHERE id > ? AND id <= ? AND event_ts IS NOT NULL
+    ORDER BY event_ts, id LIMIT 1
+    ''', (watermark, last_id))
+    first_new = cursor.fetchone()
+
+    if first_new is not None:
+        # The session the earliest new row falls in
+        cursor.execute('''
+        SELECT start_ts, start_id, end_ts, end_id FROM skid_sessions
+        WHERE group_name = ? AND (start_ts, start_id) <= (?, ?)
+        ORDER BY start_ts DESC, start_id DESC LIMIT 1
+        ''', (group_name,) + tuple(first_new))
+        session = cursor.fetchone()
+        cursor.execute("SELECT start_id FROM skid_sessions WHERE group_name = ? ORDER BY start_ts DESC, start_id DESC "
+                       "LIMIT 1", (group_name,))
+        latest = cursor.fetchone()
+        if session is not None and session[1] == latest[0] and tuple(first_new) > (session[2], session[3]):
+            # After everything rolled up so far: the latest session carries on
+            position, comparison, open_session = tuple(first_new), ">=", session[1]
+        else:
+            if session is None:
+                cursor.execute("DELETE FROM skid_sessions WHERE group_name = ?", (group_name,))
+                cursor.execute(f'SELECT event_ts, id FROM "{table_name}" WHERE event_ts IS NOT NULL '
+                               f'ORDER BY event_ts, id LIMIT 1')
+                position = tuple(cursor.fetchone())
+            else:
+                cursor.execute("DELETE FROM skid_sessions WHERE group_name = ? AND (start_ts, start_id) >= (?, ?)",
+                               (group_name, session[0], session[1]))
+                position = (session[0], session[1])
+            comparison, open_session = ">=", None
+
+        while True:
+            cursor.execute(f'''
+            SELECT id, event_ts, is_new_skid, skid_baseline_flow, decanted_volume, {pressure}, {flow}, {skid}
+            FROM "{table_name}" WHERE event_ts IS NOT NULL AND (event_ts, id) {comparison} (?, ?)
+            ORDER BY event_ts, id LIMIT ?
+            ''', position + (chunk_rows or skid_session_chunk_rows,))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            df = pd.DataFrame(rows, columns=["id", "event_ts", "is_new_skid", "baseline_flow", "decanted_volume",
+                                             "pressure", "flow", "skid_id"])
+
+            # Every row belongs to the session started by the last skid change at or before it. Rows before the first
+            # change in this chunk continue the open session, or start one when the replay begins with them
+            session = df["id"].where(df["is_new_skid"] == "Yes").ffill()
+            df["start_id"] = session.fillna(open_session if open_session is not None
+                                            else df["id"].iloc[0]).astype("int64")
+
+            # first()/last() skip missing values, so these are the first and last readings of each session in the chunk
+            sessions = df.groupby("start_id", sort=False).agg(
+                end_id=("id", "last"), start_ts=("event_ts", "first"), end_ts=("event_ts", "last"),
+                skid_id=("skid_id", "first"), baseline_flow=("baseline_flow", "first"), final_flow=("flow", "last"),
+                delivered_volume=("decanted_volume", "last"), pressure_min=("pressure", "min"),
+                pressure_max=("pressure", "max"), readings=("id", "size")).reset_index()
+            sessions.insert(0, "group_name", group_name)
+            sessions = sessions.astype(object).where(sessions.notna(), None)
+
+            # A session continued from an earlier chunk or run keeps its start and extends its end
+            cursor.executemany(f'''
+            INSERT INTO skid_sessions ({", ".join(sessions.columns)})
+            VALUES ({", ".join("?" for _ in sessions.columns)})
+            ON CONFLICT (group_name, start_id) DO UPDATE SET
+                end_id = excluded.end_id,
+                start_ts = COALESCE(start_ts, excluded.start_ts),
+                end_ts = COALESCE(excluded.end_ts, end_ts),
+                skid_id = COALESCE(skid_id, excluded.skid_id),
+                baseline_flow = COALESCE(baseline_flow, excluded.baseline_flow),
+                final_flow = COALESCE(excluded.final_flow, final_flow),
+                delivered_volume = COALESCE(excluded.delivered_volume, delivered_volume),
+                {rollup_merge("pressure_min", "MIN")},
+                {rollup_merge("pressure_max", "MAX")},
+                readings = readings + excluded.readings
+            ''', sessions.itertuples(index=False, name=None))
+            open_session = int(df["start_id"].iloc[-1])
+            position, comparison = (df["event_ts"].iloc[-1], int(df["id"].iloc[-1])), ">"
+
+    save_state(conn, state_key, last_id)
+
+def rebuild_skid_sessions():
+    """Regenerate skid_sessions by replaying the stored rows of every group"""
+    conn = connect_database()
+    initialize_database(conn)
+    try:
+        conn.execute("DELETE FROM skid_sessions")
+        conn.execute("DELETE FROM analyzer_state WHERE key LIKE 'skid_session_watermark:%'")
+        for group_name in group_mappings:
+            table_name = sanitize_table_name(group_name)
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone():
+                create_group_table(conn, group_name)
+                update_skid_sessions(conn, group_name)
+                print(f"Rebuilt skid sessions for group: {group_name}")
+        conn.commit()
+    finally:
+        conn.close()
+
+# -----------------------------
+# Pipeline metrics in the Prometheus text format. Counters and histograms are kept per group in memory, stored in
+# analyzer_state at the end of a run so they keep counting up across cron runs, written to a textfile collector file
+# (node_exporter --collector.textfile.directory, or windows_exporter's textfile_inputs) after each one-shot run and
+# served on /metrics in watch and serve mode.
+# -----------------------------
+metrics_host = "127.0.0.1"
+metrics_port = 9466
+metrics_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]  # Histogram bounds in seconds
+
+# Metric name -> (type, help text)
+metric_definitions = {
+    "chat_csv_read_seconds": ("histogram", "Time spent reading and parsing a chunk of new chat log lines"),
+    "chat_csv_read_bytes_total": ("counter", "Bytes of new chat log lines read"),
+    "chat_messages_total": ("counter", "Messages received per group, from the chat log, the ingest socket or an import"),
+    "chat_extraction_seconds": ("histogram", "Time spent extracting readings and tracking skids for a group's messages in a batch"),
+    "chat_prefilter_passed_total": ("counter", "Messages the label prefilter passed on to the patterns"),
+    "chat_prefilter_rejected_total": ("counter", "Messages the label prefilter dropped without running the patterns"),
+    "chat_messages_matched_total": ("counter", "Messages with at least 3 readings, kept as rows"),
+    "chat_messages_rejected_total": ("counter", "Messages of a mapped group with fewer than 3 readings, not stored"),
+    "chat_skid_changes_total": ("counter", "New skids detected in the kept rows"),
+    "chat_rows_inserted_total": ("counter", "Rows inserted into the group's table"),
+    "chat_rows_skipped_total": ("counter", "Kept rows not inserted, because the message was already stored or the insert failed"),
+    "chat_last_insert_timestamp_seconds": ("gauge", "Unix time rows were last inserted for the group"),
+    "chat_commit_seconds": ("histogram", "Time spent committing a batch"),
+    "chat_last_run_timestamp_seconds": ("gauge", "Unix time the last one-shot run finished"),
+    "chat_last_run_duration_seconds": ("gauge", "Duration of the last one-shot run"),
+    "chat_last_run_success": ("gauge", "1 if the last one-shot run finished without an error, 0 otherwise")
+}
+
+class PipelineMetrics:
+    """Counters, gauges and histograms labelled by group (None for the unlabelled ones)"""
+
+    def __init__(self):
+        self.values = {name: {} for name in metric_definitions}
+        self.lock = threading.Lock()
+
+    def inc(self, name, amount=1, group=None):
+        with self.lock:
+            self.values[name][group] = self.values[name].get(group, 0) + amount
+
+    def set(self, name, value, group=None):
+        with self.lock:
+            self.values[name][group] = value
+
+    def observe(self, name, seconds, group=None):
+        """Add one observation to a histogram, kept as per-bucket counts (the last one is +Inf), sum and count"""
+        with self.lock:
+            histogram = self.values[name].setdefault(group, [[0] * (len(metrics_buckets) + 1), 0.0, 0])
+            histogram[0][bisect.bisect_left(metrics_buckets, seconds)] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def reset(self):
+        with self.lock:
+            self.values = {name: {} for name in metric_definitions}
+
+    def merge(self, state):
+        """Add values recorded in a worker process (see to_state): counters and histograms add up, gauges are set"""
+        for name, series in state.items():
+            kind = metric_definitions[name][0]
+            for group, value in series.items():
+                group = group or None
+                if kind == "counter":
+                    self.inc(name, value, group)
+                elif kind == "gauge":
+                    self.set(name, value, group)
+                else:
+                    with self.lock:
+                        histogram = self.values[name].setdefault(group, [[0] * (len(metrics_buckets) + 1), 0.0, 0])
+                        histogram[0] = [a + b for a, b in zip(histogram[0], value[0])]
+                        histogram[1] += value[1]
+                        histogram[2] += value[2]
+
+    def to_state(self):
+        """JSON-friendly copy of the values, groups keyed by name ("" for unlabelled)"""
+        with self.lock:
+            return {name: {group or "": value for group, value in series.items()}
+                    for name, series in self.values.items() if series}
+
+    def load_state(self, state):
+        """Continue from values saved by to_state. Histograms saved with other bucket bounds start again"""
+        with self.lock:
+            for name, series in (state or {}).items():
+                if name not in metric_definitions:
+                    continue
+                for group, value in series.items():
+                    if metric_definitions[name][0] == "histogram" and len(value[0]) != len(metrics_buckets) + 1:
+                        continue
+                    self.values[name][group or None] = value
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            for name, (kind, help_text) in metric_definitions.items():
+                series = self.values[name]
+                if not series:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for group in sorted(series, key=lambda group: group or ""):
+                    labels = f'group="{escape_label(group)}"' if group is not None else ""
+                    if kind != "histogram":
+                        lines.append(f"{name}{{{labels}}} {format_value(series[group])}" if labels else
+                                     f"{name} {format_value(series[group])}")
+                        continue
+                    counts, total, count = series[group]
+                    cumulative = 0
+                    for bound, bucket_count in zip(metrics_buckets + ["+Inf"], counts):
+                        cumulative += bucket_count
+                        le = f'le="{bound}"'
+                        lines.append(f"{name}_bucket{{{labels + ',' if labels else ''}{le}}} {cumulative}")
+                    suffix = f"{{{labels}}}" if labels else ""
+                    lines.append(f"{name}_sum{suffix} {format_value(total)}")
+                    lines.append(f"{name}_count{suffix} {count}")
+        return "\n".join(lines) + "\n"
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+metrics = PipelineMetrics()
+
+def load_metrics(conn):
+    metrics.load_state(load_state(conn, "metrics"))
+
+def save_metrics(conn):
+    """Store the metrics so the next run carries on counting. Commits, so only call it between batches"""
+    save_state(conn, "metrics", metrics.to_state())
     conn.commit()
-    return rows_inserted
+
+def write_metrics_file(path=None):
+    """Write the metrics for the textfile collector, through a temporary file so it never reads a partial one"""
+    path = path or settings.metrics_file
+    try:
+        with open(path + ".tmp", 'w', encoding='utf-8', newline='\n') as f:
+            f.write(metrics.render())
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"Could not write the metrics file {path}: {e}")
+
+def finish_run(conn, started, succeeded, path=None):
+    """Record a one-shot run's outcome, store the metrics and write the textfile"""
+    metrics.set("chat_last_run_timestamp_seconds", round(time.time(), 3))
+    metrics.set("chat_last_run_duration_seconds", round(time.time() - started, 3))
+    metrics.set("chat_last_run_success", 1 if succeeded else 0)
+    try:
+        # A failed batch is still open, its rows must not be committed with the metrics
+        conn.rollback()
+        save_metrics(conn)
+    except sqlite3.Error as e:
+        print(f"Could not save the metrics: {e}")
+    write_metrics_file(path)
+
+def start_metrics_server(host=metrics_host, port=metrics_port):
+    """Serve /metrics from a background thread. Returns the server, or None if the port can't be used"""
+    if not port:
+        return None
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Prometheus scrapes every few seconds, that would drown out the analyzer's own output
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"Could not serve metrics on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
 
 # -----------------------------
-# Main processing
+# Batch processing shared by the one-shot run and watch mode
 # -----------------------------
-def main():
-    # Load context
-    skid_context = load_skid_context()
-    
-    # Initialize database
-    initialize_database()
-    
-    # Load and process CSV
-    df = pd.read_csv(csv_file)
-    print("CSV loaded successfully with {} rows.".format(len(df)))
+def process_group_worker(df_group, group_name, group_context):
+    """Run process_group for one group in a worker process.
+
+    Each group only reads and writes its own context entry, so the worker gets a copy of that entry and returns
+    the processed rows together with the updated entry, the seconds the extraction took and the metrics it recorded.
+    """
+    skid_context = {group_name: dict(group_context)} if group_context is not None else {}
+    metrics.reset()
+    started = time.perf_counter()
+    processed_df = process_group(df_group, group_name, skid_context)
+    return processed_df, skid_context.get(group_name), time.perf_counter() - started, metrics.to_state()
+
+def process_batch(conn, df, skid_context, verified_groups=None, verbose=True, executor=None):
+    """Extract, track and insert one batch of chat log rows. Returns the number of rows inserted.
+
+    The rows are left uncommitted so the caller can commit them together with the context (see commit_batch).
+    verified_groups is a set of groups whose table already exists, so long running callers only create
+    each table once. With an executor (a ProcessPoolExecutor) the groups are extracted in parallel and this
+    process stays the only one writing to the database.
+    """
+    # Only the row positions of each group are kept, a group's rows are taken from the batch when it's processed.
+    # Line breaks in messages are left alone, the patterns match them where they expect a space
+    group_rows = df.groupby('Group Name').indices
+    group_names = sorted(group_rows)
+    if verbose:
+        print("Found groups:", group_names)
     
-    # Check if CSV is empty - if so, exit gracefully
-    if len(df) == 0:
-        print("No data to process in CSV file. Exiting.")
-        return
+    # Create the tables first, creating a table commits and must not split the batch's transaction
+    ready_groups = []
+    for group_name in group_names:
+        if verified_groups is None or group_name not in verified_groups:
+            if not create_group_table(conn, group_name):
+                print(f"Skipping group '{group_name}' due to table creation failure")
+                continue
+            if verified_groups is not None:
+                verified_groups.add(group_name)
+        ready_groups.append(group_name)
     
-    # Clean up message text (to remove newlines and other unwanted characters)
-    df.iloc[:, 2] = df.iloc[:, 2].astype(str).replace(r"\r?\n", " ", regex=True)
-    grouped = df.groupby('Group Name')
-    group_dfs_raw = {group_name: group_df.copy() for group_name, group_df in grouped}
-    print("Found groups:", list(group_dfs_raw.keys()))
+    # Start the extraction of every group in the pool, the results are collected in order below
+    futures = {}
+    if executor is not None:
+        for group_name in ready_groups:
+            if group_name in group_mappings:
+                futures[group_name] = executor.submit(
+                    process_group_worker, df.take(group_rows[group_name]), group_name, skid_context.get(group_name))
     
-    # Process each group
-    conn = sqlite3.connect(database_file)
     total_inserted = 0
-    
-    for group_name, group_df in group_dfs_raw.items():
-        print(f"Processing group: {group_name}")
+    for group_name in ready_groups:
+        if verbose:
+            print(f"Processing group: {group_name}")
         
-        # Create table for this group if it doesn't exist
-        if not create_group_table(conn, group_name):
-            print(f"Skipping group '{group_name}' due to table creation failure")
+        metrics.inc("chat_messages_total", len(group_rows[group_name]), group_name)
+        
+        # Unmapped groups (e.g. CNG Dispatch) only need their table, long running modes skip them quietly
+        if group_name not in group_mappings and not verbose:
             continue
         
         # Process the group data
-        processed_df = process_group(group_df, group_name, skid_context)
+        if group_name in futures:
+            processed_df, skid_context[group_name], seconds, worker_metrics = futures[group_name].result()
+            metrics.merge(worker_metrics)
+        else:
+            started = time.perf_counter()
+            processed_df = process_group(df.take(group_rows[group_name]), group_name, skid_context)
+            seconds = time.perf_counter() - started
+        if group_name in group_mappings:
+            matched = 0 if processed_df is None else len(processed_df)
+            metrics.observe("chat_extraction_seconds", seconds, group_name)
+            metrics.inc("chat_messages_matched_total", matched, group_name)
+            metrics.inc("chat_messages_rejected_total", len(group_rows[group_name]) - matched, group_name)
         if processed_df is not None:
+            metrics.inc("chat_skid_changes_total", int((processed_df["is_new_skid"] == "Yes").sum()), group_name)
             # Insert data into database
-            rows_inserted = insert_data_to_db(conn, group_name, processed_df)
+            rows_inserted, rows_skipped = insert_data_to_db(conn, group_name, processed_df, commit=False)
+            if rows_inserted:
+                update_rollups(conn, group_name)
+                update_skid_sessions(conn, group_name)
+                metrics.set("chat_last_insert_timestamp_seconds", round(time.time(), 3), group_name)
+            metrics.inc("chat_rows_inserted_total", rows_inserted, group_name)
+            metrics.inc("chat_rows_skipped_total", rows_skipped, group_name)
             total_inserted += rows_inserted
-            print(f"Inserted {rows_inserted} new rows for group '{group_name}'")
-        else:
+            if verbose:
+                print(f"Inserted {rows_inserted} new rows for group '{group_name}' ({rows_skipped} skipped)")
+        elif verbose:
             print(f"No valid data extracted for group '{group_name}'")
+    return total_inserted
+
+def commit_batch(conn, skid_context, checkpoint=None):
+    """Save the context (and CSV checkpoint) and commit them in one transaction with the batch's rows"""
+    save_skid_context(conn, skid_context)
+    if checkpoint is not None:
+        save_csv_checkpoint(conn, checkpoint)
+    timed_commit(conn)
+
+def timed_commit(conn):
+    started = time.perf_counter()
+    conn.commit()
+    metrics.observe("chat_commit_seconds", time.perf_counter() - started)
+
+def rollback_batch(conn, skid_context):
+    """Undo a failed batch and reset the in-memory context to the committed one"""
+    conn.rollback()
+    skid_context.clear()
+    skid_context.update(load_skid_context(conn))
+
+# -----------------------------
+# Main processing
+# -----------------------------
+def main(workers=1):
+    started = time.time()
+    # Initialize database
+    conn = connect_database()
+    initialize_database(conn)
     
-    conn.close()
+    # Load context, metrics and the position the last run reached in the CSV
+    skid_context = load_skid_context(conn)
+    checkpoint = load_csv_checkpoint(conn)
+    load_metrics(conn)
     
-    # Save updated context for the next rerun
-    save_skid_context(skid_context)
+    # Stream the CSV lines added since the last run. Each chunk's rows, the context and the checkpoint are
+    # committed together; if anything fails the next run resumes after the last committed chunk
+    executor = None
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers)
+    total_rows = 0
+    total_inserted = 0
+    succeeded = False
+    try:
+        for df, new_checkpoint in iter_new_csv_rows(settings.csv_file, checkpoint):
+            if df is not None and len(df) > 0:
+                print("CSV chunk loaded successfully with {} new rows.".format(len(df)))
+                total_rows += len(df)
+                total_inserted += process_batch(conn, df, skid_context, executor=executor)
+            commit_batch(conn, skid_context, new_checkpoint)
+        succeeded = True
+    finally:
+        finish_run(conn, started, succeeded)
+        conn.close()
+        if executor is not None:
+            executor.shutdown()
+    
+    # Check if there was anything new - if not, say so
+    if total_rows == 0:
+        print("No new data to process in CSV file. Exiting.")
+        return
     
     print(f"Process completed. Total of {total_inserted} new rows inserted into database.")
 
+def backfill_timestamps():
+    """Fill in event_ts for stored rows that have none, e.g. after timestamp_format was changed to the host's locale"""
+    conn = connect_database()
+    initialize_database(conn)
+    try:
+        group_names = [row[0] for row in conn.execute("SELECT name FROM groups ORDER BY name")]
+        for group_name in group_names:
+            table_name = sanitize_table_name(group_name)
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone():
+                create_group_table(conn, group_name)
+                backfill_event_ts(conn, table_name)
+                conn.commit()
+    finally:
+        conn.close()
 
+# -----------------------------
+# Watch mode. Keeps the database connection, compiled extractors and skid context in memory and processes the lines
+# the bot appends to the chat log as they arrive, instead of being started from cron every 30 minutes.
+# -----------------------------
+watch_poll_interval = 1.0  # Seconds between checks of the chat log when no change notification arrives
 
-    
+class FileWatcher:
+    """Wait for a file to change. Uses inotify on Linux and falls back to polling everywhere else"""
 
-# # -----------------------------
-# # Export to Excel function (This was commented out as excel does not support simultaneous read and write leading to corrupted file)
-# # -----------------------------
-# def export_to_excel(output_file=None):
-#     """Export database data to Excel for reporting"""
-#     if output_file is None:
-#         output_file = r"C:\Users\okezi\OneDrive\Documents\Git\whatsapp-bot-main\whatsapp_logs_export.xlsx"
-    
-#     conn = sqlite3.connect(database_file)
-    
-#     # Get all group tables
-#     cursor = conn.cursor()
-#     cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name != 'groups' AND name != 'sqlite_sequence'")
-#     tables = cursor.fetchall()
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.mode = "polling"
+        self._fd = None
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            # Watch the directory so a log that is deleted and recreated is still followed
+            mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+            if libc.inotify_add_watch(fd, os.path.dirname(self.path).encode(), mask) < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+            self._fd = fd
+            self.mode = "inotify"
+        except (OSError, AttributeError):
+            # No inotify (Windows, macOS) or it could not be set up
+            pass
+
+    def wait(self, timeout):
+        """Block until the file changes or `timeout` seconds pass"""
+        if self._fd is None:
+            time.sleep(timeout)
+            return
+        deadline = time.monotonic() + timeout
+        name = os.path.basename(self.path).encode()
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if ready and name in self._read_event_names():
+                return
+
+    def _read_event_names(self):
+        """Drain pending inotify events and return the file names they refer to"""
+        names = set()
+        while True:
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return names
+            offset = 0
+            # struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+            while offset + 16 <= len(buffer):
+                _, _, _, name_length = struct.unpack_from("iIII", buffer, offset)
+                names.add(buffer[offset + 16:offset + 16 + name_length].rstrip(b"\0"))
+                offset += 16 + name_length
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+# -----------------------------
+# Excel report kept up to date by the long running modes. It is built from a snapshot in a background process
+# (chat_export.start_excel_export), so messages keep being processed while it is written.
+# -----------------------------
+report_interval = 0  # Seconds between Excel reports in watch and serve mode, 0 turns them off
+
+def schedule_report(report):
+    """Start building the Excel report once the previous one has finished and report_interval has passed since it
+    started. `report` holds the running export between calls."""
+    if not report_interval:
+        return
+    future = report.get("future")
+    if future is not None:
+        if not future.done():
+            return
+        if future.exception() is not None:
+            print(f"Error in Excel report: {future.exception()}")
+        report["future"] = None
+    if "started" in report and time.monotonic() - report["started"] < report_interval:
+        return
+    from chat_export import start_excel_export
+    report["started"] = time.monotonic()
+    report["future"] = start_excel_export(settings.excel_file, settings.database_file)
+
+def watch(poll_interval=watch_poll_interval):
+    """Process new chat log lines in micro-batches until interrupted"""
+    conn = connect_database()
+    initialize_database(conn)
+    skid_context = load_skid_context(conn)
+    checkpoint = load_csv_checkpoint(conn)
+    load_metrics(conn)
+    verified_groups = set()
+    report = {}
+    watcher = FileWatcher(settings.csv_file)
+    metrics_server = start_metrics_server(metrics_host, metrics_port)
     
-#     # Export each table to a sheet
-#     with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-#         for table in tables:
-#             table_name = table[0]
-#             # Read data from the table
-#             df = pd.read_sql_query(f'SELECT * FROM "{table_name}"', conn)
-#             # Use the original group name for the sheet
-#             cursor.execute("SELECT name FROM groups WHERE ? LIKE sanitize_table_name(name)", (table_name,))
-#             result = cursor.fetchone()
-#             sheet_name = result[0] if result else table_name
-#             # Write to Excel
-#             df.to_excel(writer, sheet_name=sheet_name, index=False)
+    # Stop cleanly when the service manager stops us
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
     
-#     conn.close()
-#     print(f"Data exported to Excel: {output_file}")
+    print(f"Watching {settings.csv_file} for new messages ({watcher.mode})")
+    try:
+        while True:
+            if os.path.exists(settings.csv_file):
+                try:
+                    for df, new_checkpoint in iter_new_csv_rows(settings.csv_file, checkpoint):
+                        if df is not None and len(df) > 0:
+                            rows_inserted = process_batch(conn, df, skid_context, verified_groups, verbose=False)
+                            print(f"{datetime.now():%Y-%m-%d %H:%M:%S} Processed {len(df)} new messages, inserted {rows_inserted} rows")
+                        # Every micro-batch is committed together with its context and checkpoint
+                        if new_checkpoint != checkpoint:
+                            commit_batch(conn, skid_context, new_checkpoint)
+                            checkpoint = new_checkpoint
+                except Exception as e:
+                    # The same lines are tried again on the next pass
+                    print(f"Error processing new messages: {e}")
+                    print(traceback.format_exc())
+                    rollback_batch(conn, skid_context)
+            
+            schedule_report(report)
+            watcher.wait(poll_interval)
+    except KeyboardInterrupt:
+        print("Stopping watch mode")
+    finally:
+        watcher.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        conn.rollback()
+        save_metrics(conn)
+        conn.close()
+
+# -----------------------------
+# Ingest server. index.js sends each message as one line of JSON over a local socket instead of appending it to the
+# CSV, and gets an acknowledgement line back once the batch holding it is committed. Messages arrive unmodified.
+# Lines that index.js had to write to the CSV (analyzer not running) are picked up from there as before.
+# -----------------------------
+ingest_host = "127.0.0.1"
+ingest_port = 8765
+ingest_batch_size = 500  # Most messages written in one batch
+ingest_flush_interval = 0.2  # Seconds to wait for more messages before writing a partial batch
+ingest_line_limit = 1024 * 1024  # Longest accepted JSON line in bytes
+
+# JSON record field -> chat log column, in chat log column order
+ingest_fields = {
+    "group": "Group Name",
+    "sender": "Sender Name",
+    "message": "Message",
+    "phone": "Phone Number",
+    "date": "Date",
+    "time": "Time",
+    "id": "Message ID"
+}
+
+def records_to_frame(records):
+    """Turn ingest records into the same DataFrame layout iter_new_csv_rows produces"""
+    return pd.DataFrame([[record.get(field) for field in ingest_fields] for record in records], columns=csv_columns)
+
+def serve(host=ingest_host, port=ingest_port, batch_size=ingest_batch_size,
+          flush_interval=ingest_flush_interval, poll_interval=watch_poll_interval):
+    """Accept messages on the ingest socket until interrupted.
+
+    All database work runs on a single writer thread, so batches from different connections never interleave.
+    A connection is not read while its batch is being written, which pushes back on the sender through TCP.
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    writer_thread = ThreadPoolExecutor(max_workers=1)
+    verified_groups = set()
+    skid_context = {}
+    state = {"conn": None, "checkpoint": None}
+    report = {}
+
+    def connection():
+        # sqlite3 connections belong to the thread that opened them, so it is opened on the writer thread
+        if state["conn"] is None:
+            state["conn"] = connect_database()
+            initialize_database(state["conn"])
+            skid_context.update(load_skid_context(state["conn"]))
+            state["checkpoint"] = load_csv_checkpoint(state["conn"])
+            load_metrics(state["conn"])
+        return state["conn"]
+
+    def write_records(records):
+        conn = connection()
+        try:
+            rows_inserted = process_batch(conn, records_to_frame(records), skid_context, verified_groups, verbose=False)
+            commit_batch(conn, skid_context)
+        except Exception:
+            rollback_batch(conn, skid_context)
+            raise
+        return rows_inserted
+
+    def catch_up_csv():
+        conn = connection()
+        if not os.path.exists(settings.csv_file):
+            return
+        try:
+            for df, new_checkpoint in iter_new_csv_rows(settings.csv_file, state["checkpoint"]):
+                if df is not None and len(df) > 0:
+                    rows_inserted = process_batch(conn, df, skid_context, verified_groups, verbose=False)
+                    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} Processed {len(df)} messages from the CSV, inserted {rows_inserted} rows")
+                if new_checkpoint != state["checkpoint"]:
+                    commit_batch(conn, skid_context, new_checkpoint)
+                    state["checkpoint"] = new_checkpoint
+        except Exception as e:
+            print(f"Error processing the CSV: {e}")
+            print(traceback.format_exc())
+            rollback_batch(conn, skid_context)
+
+    def close_connection():
+        if state["conn"] is not None:
+            state["conn"].rollback()
+            save_metrics(state["conn"])
+            state["conn"].close()
+            state["conn"] = None
+
+    async def reply(writer, message):
+        writer.write(json.dumps(message).encode("utf-8") + b"\n")
+        await writer.drain()
+
+    async def handle(reader, writer):
+        loop = asyncio.get_running_loop()
+        records = []
+        lines = 0
+        rejected = 0
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), timeout=flush_interval if lines else None)
+                except asyncio.TimeoutError:
+                    line = None
+                if line:
+                    lines += 1
+                    try:
+                        record = json.loads(line)
+                        if not isinstance(record, dict):
+                            raise ValueError("record must be a JSON object")
+                        records.append(record)
+                    except ValueError as e:
+                        rejected += 1
+                        await reply(writer, {"error": f"Invalid record: {e}"})
+
+                # Write the batch when it is full, when the sender pauses, or when it disconnects
+                end_of_stream = line == b""
+                if lines and (line is None or end_of_stream or lines >= batch_size):
+                    rows_inserted = 0
+                    if records:
+                        rows_inserted = await loop.run_in_executor(writer_thread, write_records, records)
+                    if not end_of_stream:
+                        await reply(writer, {"ack": lines, "inserted": rows_inserted, "rejected": rejected})
+                    records, lines, rejected = [], 0, 0
+                if end_of_stream:
+                    break
+        except Exception as e:
+            # Nothing is acknowledged, so the sender keeps the messages and logs them to the CSV instead
+            print(f"Error in ingest connection: {e}")
+            print(traceback.format_exc())
+            try:
+                await reply(writer, {"error": str(e)})
+            except Exception:
+                pass
+        finally:
+            writer.close()
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(handle, host, port, limit=ingest_line_limit)
+        print(f"Ingest server listening on {host}:{port}")
+        async with server:
+            while True:
+                await loop.run_in_executor(writer_thread, catch_up_csv)
+                schedule_report(report)
+                await asyncio.sleep(poll_interval)
+
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    metrics_server = start_metrics_server(metrics_host, metrics_port)
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print("Stopping ingest server")
+    finally:
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        writer_thread.submit(close_connection).result()
+        writer_thread.shutdown()
+
+# -----------------------------
+# WhatsApp "Export chat" files. History from before the bot ran, or from times its session was logged out, is read
+# from the phone's chat export and goes through the same extraction and skid tracking as the chat log.
+# -----------------------------
+export_chunk_rows = 100000  # Messages processed and committed at a time
+export_detect_lines = 10000  # Message headers looked at to work out the date order
+
+# "31/12/2024, 21:41 - Name: text" (Android) or "[31/12/2024, 9:41:05 PM] Name: text" (iPhone). Dates use the
+# phone's locale: "/", "." or "-" separated, day or month first, 2 or 4 digit years
+export_header = re.compile(
+    r"^\u200e?\[?(\d{1,4})[./-](\d{1,2})[./-](\d{1,4}),? (\d{1,2})[:.](\d{2})(?:[:.](\d{2}))?"
+    r"(?:[ \u00a0\u202f]?([AaPp])\.? ?[Mm]\.?)?\]?(?: -|:)? (.*)$")
+# Sender and text of a header. Lines without a sender ("Messages and calls are end-to-end encrypted",
+# "Ada added Bola", ...) are system lines
+export_sender = re.compile(r"^([^:\"\u201c]{1,80}?): (.*)$", re.DOTALL)
+export_phone = re.compile(r"^\+?[\d\s()-]{7,}$")
+
+def detect_date_order(lines, limit=export_detect_lines):
+    """Work out whether the export's dates are "dmy", "mdy" or "ymd" from its first message headers"""
+    for count, line in enumerate(lines):
+        if count >= limit:
+            break
+        m = export_header.match(line)
+        if not m:
+            continue
+        first, second = int(m.group(1)), int(m.group(2))
+        if len(m.group(1)) == 4:
+            return "ymd"
+        if first > 12:
+            return "dmy"
+        if second > 12:
+            return "mdy"
+    # Every date seen could be either way round, this is the more common order outside the US
+    print("Could not tell the date order of the export from its dates, assuming day/month/year (use --date-order).")
+    return "dmy"
+
+def export_timestamp(m, date_order):
+    """Format a header's date and time the way index.js logs them (M/D/YYYY and h:mm:ss AM)"""
+    a, b, c = int(m.group(1)), int(m.group(2)), int(m.group(3))
+    if date_order == "ymd":
+        year, month, day = a, b, c
+    elif date_order == "mdy":
+        month, day, year = a, b, c
+    else:
+        day, month, year = a, b, c
+    if year < 100:
+        year += 2000
+
+    hour, minute, second = int(m.group(4)), int(m.group(5)), int(m.group(6) or 0)
+    if m.group(7):
+        suffix = "PM" if m.group(7) in "Pp" else "AM"
+    else:
+        suffix = "PM" if hour >= 12 else "AM"
+        hour = hour % 12 or 12
+    return f"{month}/{day}/{year}", f"{hour}:{minute:02d}:{second:02d} {suffix}"
+
+def iter_export_rows(path, group_name, date_order=None, chunk_rows=export_chunk_rows):
+    """Yield the messages of a WhatsApp chat export as DataFrames in the chat log's layout (csv_columns).
+
+    The file is read line by line and at most chunk_rows messages are held at a time. Lines that don't start with a
+    message header continue the previous message. System lines are skipped.
+    """
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        if date_order is None:
+            date_order = detect_date_order(f)
+            f.seek(0)
+
+        rows = []
+        message = None
+        skipped = 0
+        for line in f:
+            line = line.rstrip("\r\n")
+            m = export_header.match(line)
+            if m is None:
+                # Continuation of a multi-line message
+                if message is not None:
+                    message[2] += "\n" + line
+                continue
+
+            sender = export_sender.match(m.group(8))
+            if sender is None:
+                message = None
+                skipped += 1
+                continue
+
+            name, text = sender.group(1), sender.group(2)
+            phone = re.sub(r"\D", "", name) if export_phone.match(name) else ""
+            date, time_str = export_timestamp(m, date_order)
+            message = [group_name, name, text, phone, date, time_str, None]
+            rows.append(message)
+
+            # A full chunk is only handed out once the next header shows its last message is complete
+            if len(rows) > chunk_rows:
+                yield pd.DataFrame(rows[:-1], columns=csv_columns)
+                rows = rows[-1:]
+
+        if rows:
+            yield pd.DataFrame(rows, columns=csv_columns)
+    if skipped:
+        print(f"Skipped {skipped} system lines of the export")
+
+def export_group_name(path):
+    """Group name from an export's file name ("WhatsApp Chat with <group>.txt")"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    return re.sub(r"^WhatsApp Chat (?:with |- )", "", name)
+
+def import_export(path, group_name=None, date_order=None):
+    """Import a WhatsApp chat export into the group's table.
+
+    Exports are usually older than what the chat log already holds, so the skids are tracked from a fresh context and
+    the stored skid context of the live log is left alone. Messages already in the table are skipped like on any run.
+    """
+    group_name = group_name or export_group_name(path)
+    if group_name not in group_mappings:
+        print(f"No parameter mapping defined for group '{group_name}'. Use --group to name the group.")
+        return
+
+    conn = connect_database()
+    initialize_database(conn)
+    load_metrics(conn)
+    skid_context = {}
+    total_messages = 0
+    total_inserted = 0
+    try:
+        for df in iter_export_rows(path, group_name, date_order):
+            total_messages += len(df)
+            total_inserted += process_batch(conn, df, skid_context, verbose=False)
+            timed_commit(conn)
+            print(f"Imported {total_messages} messages, inserted {total_inserted} rows")
+    finally:
+        conn.rollback()
+        save_metrics(conn)
+        write_metrics_file()
+        conn.close()
+
+    print(f"Import completed. Total of {total_inserted} new rows inserted for group '{group_name}'.")
 
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Extract readings from the WhatsApp chat log into the database")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and process new chat log lines as they arrive")
+    parser.add_argument("--serve", action="store_true",
+                        help="accept messages from index.js on a local socket (lines written to the CSV are still picked up)")
+    parser.add_argument("--host", default=ingest_host, help="address the ingest server listens on")
+    parser.add_argument("--port", type=int, default=ingest_port, help="port the ingest server listens on")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="extract the groups in this many worker processes (one-shot runs only)")
+    parser.add_argument("--poll-interval", type=float, default=watch_poll_interval,
+                        help="seconds between checks of the chat log in watch mode")
+    parser.add_argument("--metrics-file", default=settings.metrics_file,
+                        help="Prometheus textfile collector file written after one-shot runs and imports")
+    parser.add_argument("--metrics-port", type=int, default=metrics_port,
+                        help="port /metrics is served on in watch and serve mode (0 to turn it off)")
+    parser.add_argument("--report-interval", type=float, default=report_interval,
+                        help="seconds between Excel reports built in the background in watch and serve mode "
+                             "(default: no reports, needs openpyxl)")
+    parser.add_argument("--backfill-timestamps", action="store_true",
+                        help="parse event_ts for stored rows that have none (after changing timestamp_format)")
+    parser.add_argument("--rebuild-rollups", action="store_true",
+                        help="regenerate the hourly and daily rollup tables from the stored rows")
+    parser.add_argument("--rebuild-skid-sessions", action="store_true",
+                        help="regenerate the skid_sessions table by replaying the stored rows")
+    parser.add_argument("--import-export", metavar="FILE",
+                        help="import a WhatsApp \"Export chat\" .txt file instead of reading the chat log")
+    parser.add_argument("--group", help="group the export belongs to (default: taken from the file name)")
+    parser.add_argument("--date-order", choices=["dmy", "mdy", "ymd"],
+                        help="date order of the export (default: worked out from its dates)")
+    args = parser.parse_args()
+    settings.metrics_file = args.metrics_file
+    metrics_port = args.metrics_port
+    report_interval = args.report_interval
     try:
-        main()
-        # Uncomment if you need Excel export
-        # export_to_excel()
+        if args.backfill_timestamps:
+            backfill_timestamps()
+        elif args.rebuild_rollups:
+            rebuild_rollups()
+        elif args.rebuild_skid_sessions:
+            rebuild_skid_sessions()
+        elif args.import_export:
+            import_export(args.import_export, args.group, args.date_order)
+        elif args.serve:
+            serve(args.host, args.port, poll_interval=args.poll_interval)
+        elif args.watch:
+            watch(args.poll_interval)
+        else:
+            main(args.workers)
     except Exception as e:
         print(f"Error in main process: {e}")
         print(traceback.format_exc())
-
-print("Hello World!")
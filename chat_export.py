@@ -0,0 +1,263 @@
+import argparse
+import json
+import os
+import re
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from chat_analyzer import (connect_database, group_mappings, group_columns, key_columns, sanitize_column_name,
+                           sanitize_table_name, settings, text_params)
+from chat_query import query_pragmas
+
+# pyarrow is only needed for the Parquet export
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# openpyxl is only needed for the Excel report
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+# -----------------------------
+# Parquet export. Stored rows are copied to <export dir>/group=<table>/day=<YYYY-MM-DD>/part-<first id>.parquet, a
+# hive partitioned dataset that pyarrow, pandas, DuckDB or Spark can scan with partition and column pruning. Each run
+# only reads the rows added since the last one; the ids reached are kept in the export directory, not the database.
+# The partition key is day, not date: the rows have a date column (the logged date) and a partition key of the same
+# name either fails to merge with it or shadows it, depending on the reader.
+# -----------------------------
+parquet_state_file = "_export_state.json"
+parquet_chunk_rows = 100000  # Rows read from the database at a time
+null_partition = "__HIVE_DEFAULT_PARTITION__"  # Directory name hive readers use for a missing partition value
+
+def default_parquet_dir():
+    """The dataset goes next to the database unless --out says otherwise"""
+    return os.path.join(os.path.dirname(settings.database_file), "parquet")
+
+def parquet_schema(group_name):
+    """Typed columns of a group's export: ids as integers, event_ts as a timestamp, readings as floats"""
+    fields = [pa.field("id", pa.int64()), pa.field("event_ts", pa.timestamp("ms")),
+              pa.field("date", pa.string()), pa.field("time", pa.string()),
+              pa.field("is_new_skid", pa.bool_()), pa.field("skid_baseline_flow", pa.float64()),
+              pa.field("decanted_volume", pa.float64())]
+    for param in group_mappings[group_name]['params']:
+        fields.append(pa.field(sanitize_column_name(param), pa.string() if param in text_params else pa.float64()))
+    return pa.schema(fields)
+
+def load_export_state(out_dir):
+    path = os.path.join(out_dir, parquet_state_file)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_export_state(out_dir, state):
+    """Write the state file atomically, it's only replaced once the files it covers are in place"""
+    path = os.path.join(out_dir, parquet_state_file)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def rows_to_table(rows, columns, schema):
+    """Turn fetched rows into an Arrow table of the export schema"""
+    df = pd.DataFrame(rows, columns=columns)
+    df["event_ts"] = pd.to_datetime(df["event_ts"], format="%Y-%m-%d %H:%M:%S", errors='coerce')
+    df["is_new_skid"] = df["is_new_skid"].map({"Yes": True, "No": False})
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+def export_group_parquet(conn, group_name, out_dir, first_id, chunk_rows=None):
+    """Append a group's rows with id >= first_id to the dataset. Returns (rows written, last id written)."""
+    table_name = sanitize_table_name(group_name)
+    schema = parquet_schema(group_name)
+    # msg_key and msg_id only deduplicate the database, the dataset keeps its schema without them
+    columns = [sanitize_column_name(col) for col in ["id"] + group_columns(group_name) if col not in key_columns]
+    ts_index = columns.index("event_ts")
+    # Rows inserted while the export runs are left for the next one
+    last_id = conn.execute(f'SELECT MAX(id) FROM "{table_name}"').fetchone()[0]
+    if last_id is None or last_id < first_id:
+        return 0, first_id - 1
+
+    # One file per day and run, named after the first id of the run, so a run repeated after a crash overwrites
+    # its own files instead of duplicating them
+    writers = {}
+    written = 0
+    cursor = conn.execute(
+        f'SELECT {", ".join(columns)} FROM "{table_name}" '
+        f'WHERE id >= ? AND id <= ? ORDER BY id', (first_id, last_id))
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_rows or parquet_chunk_rows)
+            if not rows:
+                break
+            chunk = rows_to_table(rows, columns, schema)
+            days = pd.Series([row[ts_index][:10] if row[ts_index] else null_partition for row in rows])
+            for day, positions in days.groupby(days).indices.items():
+                if day not in writers:
+                    day_dir = os.path.join(out_dir, f"group={table_name}", f"day={day}")
+                    os.makedirs(day_dir, exist_ok=True)
+                    path = os.path.join(day_dir, f"part-{first_id:012d}.parquet")
+                    writers[day] = (pq.ParquetWriter(path + ".tmp", schema, compression="zstd"), path)
+                writers[day][0].write_table(chunk.take(positions))
+            written += len(rows)
+    finally:
+        for writer, path in writers.values():
+            writer.close()
+    for writer, path in writers.values():
+        os.replace(path + ".tmp", path)
+    return written, last_id
+
+def rename_date_partitions(out_dir):
+    """Rename the date=<day> directories written by earlier versions to day=<day>"""
+    for group_dir in os.listdir(out_dir):
+        group_path = os.path.join(out_dir, group_dir)
+        if not group_dir.startswith("group=") or not os.path.isdir(group_path):
+            continue
+        for partition in os.listdir(group_path):
+            if not partition.startswith("date="):
+                continue
+            old_path = os.path.join(group_path, partition)
+            new_path = os.path.join(group_path, "day=" + partition[len("date="):])
+            os.makedirs(new_path, exist_ok=True)
+            for name in os.listdir(old_path):
+                os.replace(os.path.join(old_path, name), os.path.join(new_path, name))
+            os.rmdir(old_path)
+
+def export_parquet(out_dir=None, groups=None):
+    """Export the rows added since the last run of every mapped group (or just `groups`) to Parquet"""
+    if pa is None:
+        print("Parquet export needs pyarrow. Install it with: pip install pyarrow")
+        return
+    out_dir = out_dir or default_parquet_dir()
+    os.makedirs(out_dir, exist_ok=True)
+    rename_date_partitions(out_dir)
+    state = load_export_state(out_dir)
+
+    conn = connect_database(pragmas=query_pragmas)
+    try:
+        for group_name in groups or list(group_mappings):
+            if group_name not in group_mappings:
+                print(f"No parameter mapping defined for group '{group_name}'. Skipping.")
+                continue
+            table_name = sanitize_table_name(group_name)
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                (table_name,)).fetchone():
+                continue
+            written, last_id = export_group_parquet(conn, group_name, out_dir, state.get(table_name, 0) + 1)
+            if written:
+                state[table_name] = last_id
+                save_export_state(out_dir, state)
+            print(f"Exported {written} new rows for group '{group_name}'")
+    finally:
+        conn.close()
+    print(f"Parquet export up to date in {out_dir}")
+
+# -----------------------------
+# Excel report. The old export_to_excel read the live tables while the analyzer was writing them. The report is now
+# read from one snapshot (a read transaction, which WAL mode lets the analyzer write past), built with a write-only
+# workbook that streams rows to disk, and saved to a temporary file that replaces the report in one step, so Excel
+# never opens a half-written file.
+# -----------------------------
+excel_chunk_rows = 10000  # Rows fetched from the snapshot at a time
+excel_max_rows = 1048575  # Data rows that fit on a sheet below the header
+excel_invalid_chars = re.compile(r"[\[\]:*?/\\]")
+
+def sheet_title(name, used):
+    """Sheet name for a group: Excel allows at most 31 characters, none of []:*?/\\, unique within the workbook"""
+    title = excel_invalid_chars.sub("_", name)[:31]
+    base = title
+    count = 2
+    while title.lower() in used:
+        suffix = f" ({count})"
+        title = base[:31 - len(suffix)] + suffix
+        count += 1
+    used.add(title.lower())
+    return title
+
+def export_excel(output_file=None, database=None):
+    """Write every group table to a sheet named after the group (from the groups table) of an Excel report"""
+    if Workbook is None:
+        print("Excel export needs openpyxl. Install it with: pip install openpyxl")
+        return
+    output_file = output_file or settings.excel_file
+    temp_file = output_file + ".tmp"
+
+    workbook = Workbook(write_only=True)
+    used = set()
+    conn = connect_database(database, pragmas=query_pragmas)
+    try:
+        # Every sheet is read in the same transaction, so they all show the database at the same moment
+        conn.execute("BEGIN")
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        group_names = [row[0] for row in conn.execute("SELECT name FROM groups ORDER BY id")]
+        for group_name in group_names:
+            table_name = sanitize_table_name(group_name)
+            if table_name not in tables:
+                continue
+            sheet = workbook.create_sheet(sheet_title(group_name, used))
+            cursor = conn.execute(f'SELECT * FROM "{table_name}" ORDER BY id')
+            sheet.append([column[0] for column in cursor.description])
+            rows = 0
+            while rows < excel_max_rows:
+                chunk = cursor.fetchmany(min(excel_chunk_rows, excel_max_rows - rows))
+                if not chunk:
+                    break
+                for row in chunk:
+                    sheet.append(row)
+                rows += len(chunk)
+            if rows == excel_max_rows and cursor.fetchone() is not None:
+                print(f"Sheet for '{group_name}' is full, its later rows are only in the database and Parquet export")
+        conn.commit()
+    finally:
+        conn.close()
+
+    if not used:
+        print("No group tables to export")
+        return
+    workbook.save(temp_file)
+    try:
+        os.replace(temp_file, output_file)
+    except PermissionError:
+        # Windows doesn't let a file that is open in Excel be replaced
+        print(f"Could not replace {output_file}, close it in Excel. The new report is in {temp_file}")
+        return
+    print(f"Data exported to Excel: {output_file}")
+
+_report_executor = None
+
+def start_excel_export(output_file=None, database=None):
+    """Build the Excel report in a background worker process and return its Future.
+
+    The caller carries on (e.g. processing messages) while the report is built; only one report is built at a time.
+    The analyzer's watch and serve modes use it for --report-interval.
+    """
+    global _report_executor
+    if _report_executor is None:
+        _report_executor = ProcessPoolExecutor(max_workers=1)
+    return _report_executor.submit(export_excel, output_file or settings.excel_file,
+                                   database or settings.database_file)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export the processed readings for analysis")
+    subparsers = parser.add_subparsers(dest="format", required=True)
+    parquet_parser = subparsers.add_parser("parquet", help="append new rows to a Parquet dataset partitioned by group and day")
+    parquet_parser.add_argument("--out", help=f"dataset directory (default: {default_parquet_dir()})")
+    parquet_parser.add_argument("--group", action="append", dest="groups", help="only export this group (repeatable)")
+    excel_parser = subparsers.add_parser("excel", help="write a report with one sheet per group")
+    excel_parser.add_argument("--out", help=f"report file (default: {settings.excel_file})")
+    args = parser.parse_args()
+    try:
+        if args.format == "parquet":
+            export_parquet(args.out, args.groups)
+        elif args.format == "excel":
+            export_excel(args.out)
+    except Exception as e:
+        print(f"Error in export: {e}")
+        print(traceback.format_exc())
+        sys.exit(1)
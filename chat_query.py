@@ -0,0 +1,126 @@
+import argparse
+import csv
+import re
+import sys
+import traceback
+from datetime import datetime, timedelta
+
+from chat_analyzer import (LazyModule, connect_database, group_mappings, sanitize_column_name, sanitize_table_name,
+                           sqlite_pragmas)
+
+# Only query_readings and timestamp parsing need pandas
+pd = LazyModule("pandas")
+
+# -----------------------------
+# Read path over the per-group tables written by chat_analyzer.py. Rows are selected with a range scan on the
+# event_ts index and only the requested columns are read.
+# -----------------------------
+# Columns every group table has besides its parameters
+tracking_columns = ["is_new_skid", "skid_baseline_flow", "decanted_volume"]
+
+# Same connection profile as the analyzer, but read only. In WAL mode readers don't block on the analyzer's writes
+query_pragmas = dict(sqlite_pragmas, query_only=1)
+
+def resolve_columns(group_name, params=None):
+    """Map a group's parameter names (keys of its *_param_mapping) to table columns, all of them if none are given"""
+    if group_name not in group_mappings:
+        raise ValueError(f"No parameter mapping defined for group '{group_name}'")
+    available = list(group_mappings[group_name]['params'].keys()) + tracking_columns
+    if not params:
+        params = available
+    unknown = [param for param in params if param not in available]
+    if unknown:
+        raise ValueError(f"Unknown parameters for group '{group_name}': {unknown}. Available: {available}")
+    return list(params), [sanitize_column_name(param) for param in params]
+
+def format_ts(value):
+    """Turn a datetime, Timestamp or date string into the event_ts text format, None stays None"""
+    if value is None:
+        return None
+    return pd.Timestamp(value).strftime("%Y-%m-%d %H:%M:%S")
+
+def parse_window(last):
+    """Parse a window length like "24h", "7d" or "30m" into a timedelta"""
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([mhdw])", last.strip().lower())
+    if not m:
+        raise ValueError(f"Can't read the window '{last}', use e.g. 30m, 24h, 7d or 2w")
+    unit = {"m": "minutes", "h": "hours", "d": "days", "w": "weeks"}[m.group(2)]
+    return timedelta(**{unit: float(m.group(1))})
+
+def build_query(group_name, start=None, end=None, params=None):
+    """Return (sql, arguments, column names) selecting a group's readings in [start, end) ordered by time"""
+    names, columns = resolve_columns(group_name, params)
+    conditions = ["event_ts IS NOT NULL"]
+    arguments = []
+    if start is not None:
+        conditions.append("event_ts >= ?")
+        arguments.append(format_ts(start))
+    if end is not None:
+        conditions.append("event_ts < ?")
+        arguments.append(format_ts(end))
+    sql = (f'SELECT event_ts, {", ".join(columns)} FROM "{sanitize_table_name(group_name)}" '
+           f'WHERE {" AND ".join(conditions)} ORDER BY event_ts')
+    return sql, arguments, ["event_ts"] + names
+
+def iter_readings(group_name, start=None, end=None, params=None, conn=None, batch_size=10000):
+    """Stream a group's readings in [start, end) as tuples, event_ts first and then the params in the order given.
+
+    Rows without an event_ts (stored by earlier versions and not backfilled yet) are not returned, run
+    chat_analyzer.py --backfill-timestamps to include them.
+    """
+    sql, arguments, _ = build_query(group_name, start, end, params)
+    own_conn = conn is None
+    if own_conn:
+        conn = connect_database(pragmas=query_pragmas)
+    try:
+        cursor = conn.execute(sql, arguments)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        if own_conn:
+            conn.close()
+
+def query_readings(group_name, start=None, end=None, params=None, conn=None):
+    """Return a group's readings in [start, end) as a DataFrame with a datetime event_ts column"""
+    _, _, names = build_query(group_name, start, end, params)
+    df = pd.DataFrame.from_records(iter_readings(group_name, start, end, params, conn), columns=names)
+    df["event_ts"] = pd.to_datetime(df["event_ts"])
+    return df
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Print a group's readings for a time range as CSV")
+    parser.add_argument("group", help="group name, e.g. \"Axxela CNG Supply to Tempo\"")
+    parser.add_argument("-p", "--param", action="append", dest="params",
+                        help="parameter to include (repeat for more, default: all of the group's parameters)")
+    parser.add_argument("--from", dest="start", help="start of the range (inclusive), e.g. \"2025-01-02 06:00\"")
+    parser.add_argument("--to", dest="end", help="end of the range (exclusive), default: open ended (now with --last)")
+    parser.add_argument("--last", help="window ending at --to, e.g. 24h or 7d (instead of --from)")
+    parser.add_argument("--database", help="database file (default: the analyzer's settings.database_file)")
+    args = parser.parse_args()
+    try:
+        end = pd.Timestamp(args.end) if args.end else None
+        start = pd.Timestamp(args.start) if args.start else None
+        if args.last:
+            # event_ts is the bot host's local time, so "now" is too
+            end = end or datetime.now()
+            start = end - parse_window(args.last)
+
+        conn = connect_database(args.database, pragmas=query_pragmas)
+        try:
+            writer = csv.writer(sys.stdout)
+            writer.writerow(build_query(args.group, start, end, args.params)[2])
+            writer.writerows(iter_readings(args.group, start, end, args.params, conn))
+        finally:
+            conn.close()
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    except BrokenPipeError:
+        pass
+    except Exception as e:
+        print(f"Error in query: {e}", file=sys.stderr)
+        print(traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
@@ -4,6 +4,7 @@
 const { Client, LocalAuth } = require("whatsapp-web.js");
 const qrcode = require("qrcode-terminal");
 const fs = require("fs");
+const net = require("net");
 const path = require("path");
 const { spawn } = require("child_process");
 
@@ -27,6 +28,16 @@ const client = new Client({
 });
 
 const logFile = path.join(__dirname, "chat_logs.csv"); // CSV file location
+const csvHeader = "Group Name,Sender Name,Message,Phone Number,Date,Time,Message ID";
+
+// Messages are sent to the chat analyzer's ingest server (python chat_analyzer.py --serve) when it is running,
+// and written to the CSV file when it is not
+const ingestHost = process.env.INGEST_HOST || "127.0.0.1";
+const ingestPort = Number(process.env.INGEST_PORT || 8765);
+const maxPendingRecords = 10000; // Unacknowledged messages before new ones go to the CSV instead
+let ingestSocket = null;
+let pendingRecords = []; // Sent to the analyzer but not acknowledged yet
+let replyBuffer = "";
 
 // Generate and display the QR code for authentication
 client.on("qr", (qr) => {
@@ -62,10 +73,7 @@ client.on("qr", (qr) => {
 
 // Function to clear file only if Python script runs successfully
 function clearLogFile() {
-  fs.writeFileSync(
-    logFile,
-    "Group Name,Sender Name,Message,Phone Number,Time Stamp\n"
-  ); // Reset file with headers
+  fs.writeFileSync(logFile, csvHeader + "\n"); // Reset file with headers
   console.log("Old messages cleared. Starting fresh...");
 }
 
@@ -74,13 +82,85 @@ function logMessageToFile(data) {
   fs.appendFileSync(logFile, data + "\n");
 }
 
+// Remove line breaks and commas from a free-text field to keep the CSV parseable
+function sanitizeField(text) {
+  return String(text).replace(/[\n\r]/g, " ").replace(/,/g, "");
+}
+
+// Write a message record to the CSV file. The group, sender and message are typed by people and sanitized
+function logRecordToFile(record) {
+  const group = sanitizeField(record.group);
+  const sender = sanitizeField(record.sender);
+  const message = sanitizeField(record.message);
+  logMessageToFile(
+    `${group},${sender},${message},${record.phone},${record.date},${record.time},${record.id}`
+  );
+}
+
+// Connect to the chat analyzer's ingest server, retrying every 5 seconds while it is not running
+function connectIngest() {
+  const socket = net.createConnection({ host: ingestHost, port: ingestPort });
+  socket.setEncoding("utf8");
+
+  socket.on("connect", () => {
+    ingestSocket = socket;
+    console.log(`Sending messages to the chat analyzer at ${ingestHost}:${ingestPort}`);
+  });
+
+  // Each reply line acknowledges the next `ack` messages sent, once they are stored
+  socket.on("data", (chunk) => {
+    replyBuffer += chunk;
+    let newline;
+    while ((newline = replyBuffer.indexOf("\n")) >= 0) {
+      const line = replyBuffer.slice(0, newline);
+      replyBuffer = replyBuffer.slice(newline + 1);
+      let reply;
+      try {
+        reply = JSON.parse(line);
+      } catch (err) {
+        continue;
+      }
+      if (reply.ack) {
+        pendingRecords.splice(0, reply.ack);
+      }
+      if (reply.error) {
+        console.error("Chat analyzer error:", reply.error);
+      }
+    }
+  });
+
+  socket.on("error", () => {}); // "close" follows and handles the retry
+
+  socket.on("close", () => {
+    if (ingestSocket === socket) {
+      console.log("Chat analyzer disconnected. Logging messages to the CSV file.");
+    }
+    ingestSocket = null;
+    replyBuffer = "";
+    // Anything not acknowledged goes to the CSV, the analyzer skips what it already stored
+    pendingRecords.forEach(logRecordToFile);
+    pendingRecords = [];
+    setTimeout(connectIngest, 5000);
+  });
+}
+
+// Send a message record to the analyzer, or write it to the CSV file if it is not reachable or falling behind
+function sendRecord(record) {
+  if (ingestSocket && pendingRecords.length < maxPendingRecords) {
+    pendingRecords.push(record);
+    ingestSocket.write(JSON.stringify(record) + "\n");
+  } else {
+    logRecordToFile(record);
+  }
+}
+
 // When the client is ready
 client.on("ready", () => {
   console.log("Client is ready!");
 
   // Create CSV file with headers if it doesn't exist
   if (!fs.existsSync(logFile)) {
-    logMessageToFile("Group Name,Sender Name,Message,Phone Number,Date,Time");
+    logMessageToFile(csvHeader);
   }
 
   // Print column headers to console for readability
@@ -88,11 +168,6 @@ client.on("ready", () => {
     20
   )} ${"Message".padEnd(30)} ${"Phone Number"} ${"Time Stamp".padEnd(22)}`;
 
-  //Clear csv
-  if (!fs.existsSync(logFile)) {
-    logMessageToFile("Group Name,Sender Name,Message,Phone Number,Time Stamp");
-  }
-
   // Print column headers
   console.log(headers);
   console.log("-".repeat(120)); // Separator line
@@ -111,18 +186,20 @@ async function formatAndLogMessage(message) {
   const phoneNumber = sender.id._serialized.split("@")[0];
   const senderName = sender.pushname || sender.name || "Unknown";
 
-  const sanitizedMessageBody = message.body
-    .replace(/[\n\r]/g, " ")
-    .replace(/,/g, "");
-
   const formattedMessage = `${chat.name.padEnd(25)} ${senderName.padEnd(
     20
-  )} ${sanitizedMessageBody.padEnd(30)} ${phoneNumber} ${date} ${time}`;
-
-  const csvFormattedMessage = `${chat.name},${senderName},${sanitizedMessageBody},${phoneNumber},${date},${time}`;
+  )} ${message.body.replace(/[\n\r]/g, " ").padEnd(30)} ${phoneNumber} ${date} ${time}`;
 
   console.log(formattedMessage);
-  logMessageToFile(csvFormattedMessage);
+  sendRecord({
+    group: chat.name,
+    sender: senderName,
+    message: message.body,
+    phone: phoneNumber,
+    date: date,
+    time: time,
+    id: message.id._serialized, // Lets the analyzer store each message once, however often it is sent or logged
+  });
 }
 
 // Get all WhatsApp messages.
@@ -156,4 +233,5 @@ client.on("message", async (message) => {
 });
 
 // Start the client
+connectIngest();
 client.initialize();
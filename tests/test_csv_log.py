@@ -0,0 +1,71 @@
+import chat_analyzer
+
+header = "Group Name,Sender Name,Message,Phone Number,Date,Time,Message ID\n"
+
+def log_line(message, i, sender="Emeka"):
+    """A chat log line the way index.js writes it: commas and line breaks dropped from the message, nothing quoted"""
+    message = message.replace("\n", " ").replace("\r", " ").replace(",", "")
+    return f"Nigachem CNG Supply,{sender},{message},2348000000000,1/2/2025,10:{i // 60:02d}:{i % 60:02d} AM,id{i}\n"
+
+def read_all(path, checkpoint, chunk_bytes=None):
+    frames = []
+    for df, new_checkpoint in chat_analyzer.iter_new_csv_rows(str(path), checkpoint, chunk_bytes):
+        if df is not None:
+            frames.append(df)
+        checkpoint = new_checkpoint
+    messages = [message for df in frames for message in df["Message"].tolist()]
+    return messages, checkpoint
+
+def test_unbalanced_quote_does_not_stall(tmp_path):
+    path = tmp_path / "chat_logs.csv"
+    first = ['Use the 2" hose', "Inlet pressure: 120 Bar Total flow: 5000", '"Noted', "ok"]
+    path.write_text(header + "".join(log_line(message, i) for i, message in enumerate(first)), encoding="utf-8")
+    messages, checkpoint = read_all(path, {}, chunk_bytes=16)
+    assert messages == first
+    assert checkpoint["offset"] == path.stat().st_size
+
+    # Lines appended after the quote are picked up by the next run
+    second = ["Inlet pressure: 180 Bar Total flow: 5100", 'Meter 3" line "cleared']
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(log_line(message, 10 + i) for i, message in enumerate(second)))
+    messages, checkpoint = read_all(path, checkpoint)
+    assert messages == second
+    assert checkpoint["offset"] == path.stat().st_size
+
+def test_partial_last_line_waits(tmp_path):
+    path = tmp_path / "chat_logs.csv"
+    complete = log_line('He said "ok', 0)
+    partial = log_line("Inlet pressure: 100", 1)[:30]
+    path.write_text(header + complete + partial, encoding="utf-8")
+    messages, checkpoint = read_all(path, {})
+    assert messages == ['He said "ok']
+    assert checkpoint["offset"] == len((header + complete).encode("utf-8"))
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(log_line("Inlet pressure: 100", 1)[30:])
+    messages, checkpoint = read_all(path, checkpoint)
+    assert messages == ["Inlet pressure: 100"]
+
+def test_chunks_end_on_lines(tmp_path):
+    path = tmp_path / "chat_logs.csv"
+    lines = [f'Reading {i} with a " quote' if i % 7 == 0 else f"Reading {i}" for i in range(200)]
+    path.write_text(header + "".join(log_line(message, i) for i, message in enumerate(lines)), encoding="utf-8")
+    chunks = list(chat_analyzer.iter_new_csv_rows(str(path), {}, chunk_bytes=500))
+    assert len(chunks) > 1
+    assert [message for df, _ in chunks for message in df["Message"].tolist()] == lines
+
+def test_comma_in_sender(tmp_path):
+    # Logs written before index.js took the commas out of sender names have lines with an extra field
+    path = tmp_path / "chat_logs.csv"
+    senders = ["Okezie, A.", "Emeka", "Tunde", "Okezie, A.", "Emeka"]
+    path.write_text(header + "".join(log_line(f"Reading {i}", i, sender) for i, sender in enumerate(senders)),
+                    encoding="utf-8")
+    for chunk_bytes in [None, 1]:
+        chunks = list(chat_analyzer.iter_new_csv_rows(str(path), {}, chunk_bytes))
+        df = chat_analyzer.pd.concat([df for df, _ in chunks], ignore_index=True)
+        assert df["Group Name"].tolist() == ["Nigachem CNG Supply"] * len(senders)
+        assert df["Sender Name"].tolist() == senders
+        assert df["Message"].tolist() == [f"Reading {i}" for i in range(len(senders))]
+        assert df["Phone Number"].tolist() == ["2348000000000"] * len(senders)
+        assert df["Message ID"].tolist() == [f"id{i}" for i in range(len(senders))]
+        assert chunks[-1][1]["offset"] == path.stat().st_size
@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+
+import chat_analyzer
+
+group_name = "Axxela CNG Supply to Tempo"
+table_name = chat_analyzer.sanitize_table_name(group_name)
+reading = "Skid in use: 3 Decanting: 4 Inlet pressure: 120 Bar Total flow: 5000.5 Discharge: 200 bar"
+
+def messages(*rows):
+    """Chat log frame of (sender, message, time, message id) rows, all on the same day"""
+    return pd.DataFrame([[group_name, sender, message, "2348000000000", "1/2/2025", time, msg_id]
+                         for sender, message, time, msg_id in rows], columns=chat_analyzer.csv_columns)
+
+def store(conn, df):
+    processed = chat_analyzer.process_group(df, group_name, {})
+    return chat_analyzer.insert_data_to_db(conn, group_name, processed)
+
+def stored(conn):
+    return conn.execute(f'SELECT time, msg_id FROM "{table_name}" ORDER BY id').fetchall()
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = chat_analyzer.connect_database(str(tmp_path / "dedup.db"))
+    chat_analyzer.initialize_database(conn)
+    chat_analyzer.create_group_table(conn, group_name)
+    yield conn
+    conn.close()
+
+def test_same_text_with_different_ids_is_kept(conn):
+    # Two operators post the same reading in the same minute
+    df = messages(("Emeka", reading, "10:00:05 AM", "false_1@g.us_AAA"),
+                  ("Tunde", reading, "10:00:40 AM", "false_1@g.us_BBB"))
+    assert store(conn, df) == (2, 0)
+    # Reading the same lines again stores nothing
+    assert store(conn, df) == (0, 2)
+    assert len(stored(conn)) == 2
+
+def test_without_ids_the_hash_decides(conn):
+    df = messages(("Emeka", reading, "10:00:05 AM", None), ("Emeka", reading, "10:00:40 AM", None))
+    assert store(conn, df) == (1, 1)
+
+def test_export_after_chat_log(conn):
+    store(conn, messages(("Emeka", reading, "10:00:05 AM", "false_1@g.us_AAA")))
+    # The export has no id, the minute only and the sender as saved on the phone
+    assert store(conn, messages(("Emeka Ops", reading, "10:00:00 AM", None))) == (0, 1)
+    assert stored(conn) == [("10:00:05 AM", "false_1@g.us_AAA")]
+
+def test_chat_log_after_export(conn):
+    store(conn, messages(("Emeka Ops", reading, "10:00:00 AM", None)))
+    df = messages(("Emeka", reading, "10:00:05 AM", "false_1@g.us_AAA"),
+                  ("Tunde", reading, "10:00:40 AM", "false_1@g.us_BBB"))
+    # The first message is the exported one and gives it its id, the second is new
+    assert store(conn, df) == (1, 1)
+    assert stored(conn) == [("10:00:00 AM", "false_1@g.us_AAA"), ("10:00:40 AM", "false_1@g.us_BBB")]
+    assert store(conn, df) == (0, 2)
+
+def test_unique_msg_key_index_is_replaced(conn):
+    conn.execute(f'DROP INDEX "{table_name}_msg_key"')
+    conn.execute(f'DROP INDEX "{table_name}_msg_key_without_id"')
+    conn.execute(f'CREATE UNIQUE INDEX "{table_name}_msg_key" ON "{table_name}" (msg_key)')
+    conn.commit()
+    chat_analyzer.create_group_table(conn, group_name)
+    df = messages(("Emeka", reading, "10:00:05 AM", "false_1@g.us_AAA"),
+                  ("Tunde", reading, "10:00:40 AM", "false_1@g.us_BBB"))
+    assert store(conn, df) == (2, 0)
@@ -0,0 +1,42 @@
+import pytest
+
+openpyxl = pytest.importorskip("openpyxl")
+import pandas as pd
+
+import benchmark
+import chat_analyzer
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """A database holding a few days of generated readings"""
+    path = str(tmp_path / "whatsapp_logs.db")
+    monkeypatch.setattr(chat_analyzer.settings, "database_file", path)
+    monkeypatch.setattr(chat_analyzer.settings, "excel_file", str(tmp_path / "report.xlsx"))
+    df = pd.DataFrame(benchmark.generate_messages(3000), columns=chat_analyzer.csv_columns)
+    conn = chat_analyzer.connect_database()
+    chat_analyzer.initialize_database(conn)
+    chat_analyzer.process_batch(conn, df, {}, verbose=False)
+    conn.commit()
+    conn.close()
+    return path
+
+def test_reports_are_built_in_the_background(database, monkeypatch):
+    report = {}
+    monkeypatch.setattr(chat_analyzer, "report_interval", 0)
+    chat_analyzer.schedule_report(report)
+    assert report == {}
+
+    monkeypatch.setattr(chat_analyzer, "report_interval", 3600)
+    chat_analyzer.schedule_report(report)
+    future = report["future"]
+    future.result(timeout=60)
+    workbook = openpyxl.load_workbook(chat_analyzer.settings.excel_file, read_only=True)
+    assert set(workbook.sheetnames) == set(chat_analyzer.group_mappings)
+
+    # The next report waits for the interval
+    chat_analyzer.schedule_report(report)
+    assert report["future"] is None
+    report["started"] -= 3600
+    chat_analyzer.schedule_report(report)
+    assert report["future"] is not future
+    report["future"].result(timeout=60)
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.dataset as ds
+import pandas as pd
+
+import benchmark
+import chat_analyzer
+import chat_export
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """A database holding a few days of generated readings"""
+    path = str(tmp_path / "whatsapp_logs.db")
+    monkeypatch.setattr(chat_analyzer.settings, "database_file", path)
+    df = pd.DataFrame(benchmark.generate_messages(3000), columns=chat_analyzer.csv_columns)
+    conn = chat_analyzer.connect_database()
+    chat_analyzer.initialize_database(conn)
+    chat_analyzer.process_batch(conn, df, {}, verbose=False)
+    conn.commit()
+    conn.close()
+    return path
+
+def stored_rows(path):
+    conn = chat_analyzer.connect_database(path)
+    try:
+        return {group_name: conn.execute(f'SELECT COUNT(*) FROM "{chat_analyzer.sanitize_table_name(group_name)}"')
+                .fetchone()[0] for group_name in chat_analyzer.group_mappings}
+    finally:
+        conn.close()
+
+def test_round_trip(database, tmp_path):
+    out_dir = str(tmp_path / "parquet")
+    chat_export.export_parquet(out_dir)
+    expected = stored_rows(database)
+
+    # The default readers take the whole dataset, partition keys included
+    df = pd.read_parquet(out_dir)
+    assert len(df) == sum(expected.values())
+    assert {"group", "day", "date", "event_ts"} <= set(df.columns)
+    for group_name, rows in expected.items():
+        assert (df["group"] == chat_analyzer.sanitize_table_name(group_name)).sum() == rows
+    # The partition key is the day of event_ts, the date column still holds the logged date
+    assert (df["day"].astype(str) == df["event_ts"].dt.strftime("%Y-%m-%d")).all()
+    assert df["date"].str.contains("/").all()
+
+    dataset = ds.dataset(out_dir, partitioning="hive")
+    day = sorted(df["day"].astype(str).unique())[1]
+    table = dataset.to_table(filter=ds.field("day") == day)
+    assert table.num_rows == (df["day"].astype(str) == day).sum()
+    filtered = pd.read_parquet(out_dir, filters=[("day", ">=", day)])
+    assert len(filtered) == (df["day"].astype(str) >= day).sum()
+
+def test_date_partitions_renamed(database, tmp_path):
+    out_dir = str(tmp_path / "parquet")
+    chat_export.export_parquet(out_dir)
+    # Lay the dataset out the way earlier versions did
+    for group_dir in os.listdir(out_dir):
+        group_path = os.path.join(out_dir, group_dir)
+        if os.path.isdir(group_path):
+            for partition in os.listdir(group_path):
+                os.rename(os.path.join(group_path, partition),
+                          os.path.join(group_path, partition.replace("day=", "date=")))
+
+    chat_export.export_parquet(out_dir)
+    assert len(pd.read_parquet(out_dir)) == sum(stored_rows(database).values())
@@ -0,0 +1,89 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import chat_analyzer
+
+group_name = "Axxela CNG Supply to Tempo"
+pressure = chat_analyzer.sanitize_column_name(chat_analyzer.group_mappings[group_name]['pressure_field'])
+flow = chat_analyzer.sanitize_column_name(chat_analyzer.group_mappings[group_name]['flow_field'])
+table_name = chat_analyzer.sanitize_table_name(group_name)
+
+def random_rows(rng, count):
+    """Readings over three days, some of them without a pressure, flow or event_ts"""
+    start = datetime(2025, 1, 1)
+    rows = []
+    for _ in range(count):
+        stamp = start + timedelta(seconds=rng.randrange(3 * 24 * 3600))
+        rows.append({
+            "event_ts": None if rng.random() < 0.05 else stamp.strftime("%Y-%m-%d %H:%M:%S"),
+            pressure: None if rng.random() < 0.1 else round(rng.uniform(20, 250), 1),
+            flow: None if rng.random() < 0.1 else round(rng.uniform(0, 1e5), 2),
+            "is_new_skid": "Yes" if rng.random() < 0.1 else "No",
+            "decanted_volume": None if rng.random() < 0.1 else round(rng.uniform(0, 5000), 2),
+        })
+    return rows
+
+def insert_rows(conn, rows):
+    columns = list(rows[0])
+    conn.executemany(f'INSERT INTO "{table_name}" ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})',
+                     [[row[column] for column in columns] for row in rows])
+
+def expected_rollups(rows, width):
+    """Rollups computed from scratch, in event_ts order (then insertion order)"""
+    ordered = sorted((row["event_ts"], i, row) for i, row in enumerate(rows) if row["event_ts"] is not None)
+    buckets = {}
+    previous = None
+    for _, _, row in ordered:
+        bucket = row["event_ts"][:width] + (":00:00" if width == 13 else "")
+        entry = buckets.setdefault(bucket, {"readings": 0, "pressures": [], "flows": [], "skid_changes": 0,
+                                            "volumes": []})
+        entry["readings"] += 1
+        if row[pressure] is not None:
+            entry["pressures"].append(row[pressure])
+        if row[flow] is not None:
+            entry["flows"].append(row[flow])
+        if row["is_new_skid"] == "Yes":
+            entry["skid_changes"] += 1
+            if previous is not None and previous["decanted_volume"] is not None:
+                entry["volumes"].append(previous["decanted_volume"])
+        previous = row
+    return {
+        bucket: (entry["readings"], min(entry["pressures"], default=None), max(entry["pressures"], default=None),
+                 sum(entry["pressures"]) if entry["pressures"] else None, len(entry["pressures"]),
+                 min(entry["flows"], default=None), max(entry["flows"], default=None), entry["skid_changes"],
+                 sum(entry["volumes"]) if entry["volumes"] else None)
+        for bucket, entry in buckets.items()
+    }
+
+def stored_rollups(conn, rollup_table):
+    rows = conn.execute(f'SELECT bucket, readings, pressure_min, pressure_max, pressure_sum, pressure_count, '
+                        f'flow_min, flow_max, skid_changes, decanted_volume FROM {rollup_table} WHERE group_name = ?',
+                        (group_name,)).fetchall()
+    return {row[0]: row[1:] for row in rows}
+
+@pytest.mark.parametrize("seed", range(10))
+def test_out_of_order_batches(tmp_path, seed):
+    rng = random.Random(seed)
+    conn = chat_analyzer.connect_database(str(tmp_path / "rollups.db"))
+    chat_analyzer.initialize_database(conn)
+    chat_analyzer.create_group_table(conn, group_name)
+
+    # The readings aren't sorted, so later batches hold readings from before the earlier ones, like a chat export
+    # imported after live traffic
+    rows = random_rows(rng, 400)
+    start = 0
+    while start < len(rows):
+        end = start + rng.randint(1, 80)
+        insert_rows(conn, rows[start:end])
+        chat_analyzer.update_rollups(conn, group_name)
+        start = end
+
+    for rollup_table, width in [("rollup_hourly", 13), ("rollup_daily", 10)]:
+        expected = expected_rollups(rows, width)
+        actual = stored_rollups(conn, rollup_table)
+        assert actual.keys() == expected.keys()
+        for bucket, values in expected.items():
+            assert actual[bucket] == pytest.approx(values), bucket
+    conn.close()
@@ -0,0 +1,109 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import chat_analyzer
+
+group_name = "Axxela CNG Supply to Tempo"
+config = chat_analyzer.group_mappings[group_name]
+pressure = chat_analyzer.sanitize_column_name(config['pressure_field'])
+flow = chat_analyzer.sanitize_column_name(config['flow_field'])
+skid = chat_analyzer.sanitize_column_name(config['skid_field'])
+table_name = chat_analyzer.sanitize_table_name(group_name)
+session_columns = ["start_ts", "end_ts", "skid_id", "baseline_flow", "final_flow", "delivered_volume",
+                   "pressure_min", "pressure_max", "readings"]
+
+def reading(event_ts, skid_id, pressure_value, flow_value, is_new_skid="No", baseline=None, volume=None):
+    return {"event_ts": event_ts, skid: skid_id, pressure: pressure_value, flow: flow_value,
+            "is_new_skid": is_new_skid, "skid_baseline_flow": baseline, "decanted_volume": volume}
+
+def random_rows(rng, start, count):
+    """Readings over a day, some of them without an event_ts, skid, pressure or flow"""
+    rows = []
+    for _ in range(count):
+        stamp = start + timedelta(seconds=rng.randrange(24 * 3600))
+        rows.append(reading(None if rng.random() < 0.05 else stamp.strftime("%Y-%m-%d %H:%M:%S"),
+                            None if rng.random() < 0.3 else rng.randint(1, 9),
+                            None if rng.random() < 0.1 else round(rng.uniform(20, 250), 1),
+                            None if rng.random() < 0.1 else round(rng.uniform(0, 1e5), 2),
+                            "Yes" if rng.random() < 0.1 else "No",
+                            None if rng.random() < 0.2 else round(rng.uniform(0, 1e5), 2),
+                            None if rng.random() < 0.1 else round(rng.uniform(0, 5000), 2)))
+    return rows
+
+def insert_rows(conn, rows):
+    columns = list(rows[0])
+    conn.executemany(f'INSERT INTO "{table_name}" ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})',
+                     [[row[column] for column in columns] for row in rows])
+
+def last(values):
+    values = [value for value in values if value is not None]
+    return values[-1] if values else None
+
+def expected_sessions(rows):
+    """Sessions computed from scratch, in event_ts order (then insertion order)"""
+    ordered = sorted((row["event_ts"], i, row) for i, row in enumerate(rows) if row["event_ts"] is not None)
+    sessions = []
+    for _, _, row in ordered:
+        if not sessions or row["is_new_skid"] == "Yes":
+            sessions.append([])
+        sessions[-1].append(row)
+    return [(session[0]["event_ts"], session[-1]["event_ts"], last([row[skid] for row in reversed(session)]),
+             last([row["skid_baseline_flow"] for row in reversed(session)]), last([row[flow] for row in session]),
+             last([row["decanted_volume"] for row in session]),
+             min((row[pressure] for row in session if row[pressure] is not None), default=None),
+             max((row[pressure] for row in session if row[pressure] is not None), default=None), len(session))
+            for session in sessions]
+
+def stored_sessions(conn):
+    return conn.execute(f'SELECT {", ".join(session_columns)} FROM skid_sessions WHERE group_name = ? '
+                        f'ORDER BY start_ts, start_id', (group_name,)).fetchall()
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = chat_analyzer.connect_database(str(tmp_path / "sessions.db"))
+    chat_analyzer.initialize_database(conn)
+    chat_analyzer.create_group_table(conn, group_name)
+    yield conn
+    conn.close()
+
+def test_export_imported_between_live_batches(conn):
+    insert_rows(conn, [reading("2025-02-01 08:00:00", 7, 200, 1000, "Yes", 1000),
+                       reading("2025-02-01 08:30:00", 7, 180, 1040, volume=40)])
+    chat_analyzer.update_skid_sessions(conn, group_name)
+
+    # An older export of the chat, stored after the live rows
+    insert_rows(conn, [reading("2025-01-01 09:00:00", 2, 220, 100, "Yes", 100),
+                       reading("2025-01-01 09:01:00", 2, 140, 150, volume=50)])
+    chat_analyzer.update_skid_sessions(conn, group_name)
+
+    insert_rows(conn, [reading("2025-02-01 09:00:00", 7, 160, 1120, volume=120)])
+    chat_analyzer.update_skid_sessions(conn, group_name)
+
+    assert stored_sessions(conn) == [
+        ("2025-01-01 09:00:00", "2025-01-01 09:01:00", "2", 100, 150, 50, 140, 220, 2),
+        ("2025-02-01 08:00:00", "2025-02-01 09:00:00", "7", 1000, 1120, 120, 160, 200, 3),
+    ]
+
+@pytest.mark.parametrize("seed", range(10))
+def test_out_of_order_batches(conn, seed):
+    rng = random.Random(seed)
+    # A live day, then exports of earlier days, then the live day carries on
+    rows = random_rows(rng, datetime(2025, 1, 10), 150)
+    rows[150:150] = random_rows(rng, datetime(2025, 1, 3), 100) + random_rows(rng, datetime(2025, 1, 1), 100)
+    rows += random_rows(rng, datetime(2025, 1, 11), 150)
+    start = 0
+    while start < len(rows):
+        end = start + rng.randint(1, 80)
+        insert_rows(conn, rows[start:end])
+        chat_analyzer.update_skid_sessions(conn, group_name, chunk_rows=rng.randint(5, 200))
+        start = end
+
+    actual = stored_sessions(conn)
+    expected = expected_sessions(rows)
+    assert len(actual) == len(expected)
+    for actual_session, expected_session in zip(actual, expected):
+        assert actual_session[:2] == expected_session[:2]
+        assert actual_session[2] == (None if expected_session[2] is None else str(expected_session[2]))
+        assert actual_session[3:] == pytest.approx(expected_session[3:])
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+import chat_analyzer
+
+pressure_threshold = 50
+context_keys = ["last_pressure", "last_total_flow", "skid_baseline_flow", "last_skid_change"]
+
+def random_sequence(rng, count):
+    """Pressures and total flows like the supply groups post them, with gaps, skid swaps and threshold-edge jumps"""
+    pressures = np.empty(count)
+    flows = np.empty(count)
+    pressure = rng.uniform(20, 250)
+    flow = rng.uniform(0, 1e5)
+    for i in range(count):
+        roll = rng.random()
+        if roll < 0.15:
+            # Skid swap, sometimes exactly on the threshold (no new skid) or just above it
+            pressure += rng.choice([pressure_threshold, pressure_threshold + 1e-9, rng.uniform(51, 200)])
+        elif roll < 0.2:
+            pressure += rng.uniform(-pressure_threshold, pressure_threshold)
+        else:
+            pressure -= rng.uniform(0, 5)
+        flow += rng.uniform(0, 50)
+        pressures[i] = pressure
+        flows[i] = flow
+    pressures[rng.random(count) < 0.2] = np.nan
+    flows[rng.random(count) < 0.2] = np.nan
+    if rng.random() < 0.1:
+        pressures[:] = np.nan
+    if rng.random() < 0.1:
+        flows[:] = np.nan
+    return pressures, flows
+
+def random_context(rng):
+    """An empty context as a new group starts with, or one persisted by an earlier batch"""
+    if rng.random() < 0.25:
+        return {key: None for key in context_keys}
+    return {
+        "last_pressure": None if rng.random() < 0.2 else float(rng.uniform(20, 250)),
+        "last_total_flow": None if rng.random() < 0.2 else float(rng.uniform(0, 1e5)),
+        "skid_baseline_flow": None if rng.random() < 0.3 else float(rng.uniform(0, 1e5)),
+        "last_skid_change": None if rng.random() < 0.5 else "2025-01-01 00:00:00",
+    }
+
+@pytest.mark.parametrize("seed", range(300))
+def test_vectorized_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    count = int(rng.integers(0, 60))
+    pressures, flows = random_sequence(rng, count)
+    stamps = [f"2025-01-01 00:{i // 60:02d}:{i % 60:02d}" for i in range(count)]
+    context = random_context(rng)
+    loop_context = dict(context)
+    vectorized_context = dict(context)
+
+    expected = chat_analyzer.track_skids(pressures, flows, stamps, loop_context, pressure_threshold)
+    actual = chat_analyzer.track_skids_vectorized(pressures, flows, stamps, vectorized_context, pressure_threshold)
+
+    for expected_array, actual_array in zip(expected, actual):
+        np.testing.assert_array_equal(np.asarray(actual_array), np.asarray(expected_array))
+    assert vectorized_context == loop_context
+
+def test_batches_carry_context():
+    """Splitting a sequence into batches gives the same result as one batch, through the persisted context"""
+    rng = np.random.default_rng(2025)
+    pressures, flows = random_sequence(rng, 500)
+    stamps = [f"row {i}" for i in range(500)]
+    whole_context = {key: None for key in context_keys}
+    whole = chat_analyzer.track_skids_vectorized(pressures, flows, stamps, whole_context, pressure_threshold)
+
+    batch_context = {key: None for key in context_keys}
+    parts = []
+    for start in range(0, 500, 73):
+        end = start + 73
+        parts.append(chat_analyzer.track_skids_vectorized(pressures[start:end], flows[start:end], stamps[start:end],
+                                                          batch_context, pressure_threshold))
+    for i in range(3):
+        np.testing.assert_array_equal(np.concatenate([part[i] for part in parts]), whole[i])
+    assert batch_context == whole_context